@@ -0,0 +1,93 @@
+# gemini_multichat_bot/core/context_window.py
+
+from collections import namedtuple
+
+# Gemini averages roughly four characters per token for English text. An estimate is
+# good enough for budgeting and avoids a count_tokens round trip on every message.
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PREFIX = "For context, here is a summary of our earlier conversation:\n"
+SUMMARY_ACKNOWLEDGEMENT = "Thanks, I'll keep that in mind."
+
+# contents: Gemini history (without the current message)
+# overflow: older records left out of contents (already summarized or over the budget), oldest first
+# summary: (text, summarized_through_id) or None
+# records: every record the window was built from, oldest first
+PromptWindow = namedtuple(
+    "PromptWindow",
+    ["contents", "overflow", "summary", "estimated_tokens", "dropped_tokens", "records"],
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def to_gemini_content(record: dict) -> dict:
+    """Converts a history record ({"id", "role", "content"}) to Gemini's content format."""
+    return {"role": record["role"], "parts": [record["content"]]}
+
+
+def build_prompt_window(records: list, summary, current_message_text: str, token_budget: int) -> PromptWindow:
+    """
+    Picks the most recent records that fit in token_budget (after the current message
+    and the stored summary are accounted for) and returns them as Gemini contents.
+    Records are chronological. Records the summary already covers are never kept, so
+    nothing appears in the prompt twice. The kept window always starts with a user message.
+    """
+    fixed_tokens = estimate_tokens(current_message_text)
+    summary_contents = []
+    if summary and summary[0]:
+        summary_contents = [
+            {"role": "user", "parts": [SUMMARY_PREFIX + summary[0]]},
+            {"role": "model", "parts": [SUMMARY_ACKNOWLEDGEMENT]},
+        ]
+        fixed_tokens += estimate_tokens(summary_contents[0]["parts"][0]) + estimate_tokens(SUMMARY_ACKNOWLEDGEMENT)
+    budget = token_budget - fixed_tokens
+
+    summarized = 0
+    if summary:
+        while (summarized < len(records) and records[summarized]["id"] is not None
+               and records[summarized]["id"] <= summary[1]):
+            summarized += 1
+
+    used = 0
+    first_kept = len(records)
+    for index in range(len(records) - 1, summarized - 1, -1):
+        cost = estimate_tokens(records[index]["content"])
+        if used + cost > budget:
+            break
+        used += cost
+        first_kept = index
+    # Don't open the window with a dangling model reply
+    while first_kept < len(records) and records[first_kept]["role"] != "user":
+        used -= estimate_tokens(records[first_kept]["content"])
+        first_kept += 1
+
+    kept = records[first_kept:]
+    overflow = records[:first_kept]
+    contents = summary_contents + [to_gemini_content(record) for record in kept]
+    return PromptWindow(
+        contents=contents,
+        overflow=overflow,
+        summary=summary,
+        estimated_tokens=fixed_tokens + used,
+        dropped_tokens=sum(estimate_tokens(record["content"]) for record in overflow),
+        records=records,
+    )
+
+
+def build_summary_prompt(existing_summary: str, new_records: list) -> str:
+    """Prompt asking the model to fold new_records into existing_summary."""
+    transcript = "\n".join(
+        f"{'User' if record['role'] == 'user' else 'Assistant'}: {record['content']}"
+        for record in new_records
+    )
+    return (
+        "You maintain a running summary of a chat between a user and an assistant. "
+        "Update the summary with the new messages below. Keep facts the user shared about "
+        "themselves, their preferences, open questions and decisions; drop small talk. "
+        "Reply with the updated summary only, in at most 200 words.\n\n"
+        f"Current summary:\n{existing_summary or '(none yet)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
@@ -0,0 +1,257 @@
+# gemini_multichat_bot/core/db_pool.py
+
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class _QueryCounter:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def increment(self, count: int = 1):
+        with self._lock:
+            self.value += count
+
+
+class _CountingCursor(extensions.cursor):
+    """Cursor that counts statements sent to the server (one per execute call)."""
+
+    def execute(self, query, vars=None):
+        counter = getattr(self.connection, "query_counter", None)
+        if counter is not None:
+            counter.increment()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        counter = getattr(self.connection, "query_counter", None)
+        if counter is not None:
+            counter.increment()
+        return super().executemany(query, vars_list)
+
+
+class _CountingConnection(extensions.connection):
+    query_counter = None
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", _CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """
+    A small thread-safe PostgreSQL connection pool.
+
+    Connections are created lazily up to max_size and kept open between uses.
+    On checkout, a connection that has been idle for longer than
+    health_check_interval is validated with a cheap `SELECT 1`; broken
+    connections (e.g. after a database failover) are discarded and replaced
+    transparently. A connection returned broken bumps the pool's generation, so
+    every older connection is validated on its next checkout however recently it
+    was used: a failover breaks them all at once. When every connection is in use, callers wait up to
+    `timeout` seconds for one to be returned.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 5.0, health_check_interval: float = 30.0,
+                 connect_kwargs: dict = None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs or {}
+
+        self._lock = threading.Condition()
+        self._idle = [] # List of (connection, last_used_monotonic), most recently used last
+        self._in_use = set()
+        self._closed = False
+        self._generation = 0
+        self._validated = {} # connection -> generation it was last known to work in
+
+        # Counters for sizing the pool
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._connects = 0
+        self._health_check_failures = 0
+        self._discarded = 0
+        # Statements executed on pooled connections, e.g. for DB queries per chat turn
+        self._queries = _QueryCounter()
+
+    def _connect(self):
+        kwargs = dict(self.connect_kwargs)
+        kwargs.setdefault("connection_factory", _CountingConnection)
+        conn = psycopg2.connect(self.dsn, **kwargs)
+        if isinstance(conn, _CountingConnection):
+            conn.query_counter = self._queries
+        with self._lock:
+            self._connects += 1
+            self._validated[conn] = self._generation
+        return conn
+
+    def open(self):
+        """Pre-opens min_size connections. Errors are raised to the caller."""
+        while True:
+            with self._lock:
+                if len(self._idle) + len(self._in_use) >= self.min_size:
+                    return
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        with self._lock:
+            generation = self._generation
+            stale = self._validated.get(conn, -1) < generation
+        if not stale and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        with self._lock:
+            self._validated[conn] = generation
+        return True
+
+    def _discard(self, conn):
+        self._validated.pop(conn, None)
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """Checks out a healthy connection, creating or waiting for one as needed."""
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        while True:
+            conn = None
+            last_used = None
+            create = False
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed.")
+                while not self._idle and len(self._in_use) >= self.max_size:
+                    if waited_since is None:
+                        waited_since = time.monotonic()
+                        self._waits += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._record_wait(waited_since)
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a database connection "
+                            f"(max_size={self.max_size})."
+                        )
+                    self._lock.wait(remaining)
+                    if self._closed:
+                        raise psycopg2.InterfaceError("Connection pool is closed.")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    create = True
+                # Reserve the slot before doing any network I/O outside the lock
+                placeholder = object() if create else conn
+                self._in_use.add(placeholder)
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._in_use.discard(placeholder)
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._in_use.discard(placeholder)
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                with self._lock:
+                    self._in_use.discard(conn)
+                    self._health_check_failures += 1
+                    self._discarded += 1
+                    self._lock.notify()
+                continue # Retry; a fresh connection replaces the broken one
+
+            with self._lock:
+                self._checkouts += 1
+                if waited_since is not None:
+                    self._record_wait(waited_since)
+            return conn
+
+    def _record_wait(self, waited_since: float):
+        waited = time.monotonic() - waited_since
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+
+    def putconn(self, conn, discard: bool = False):
+        """Returns a connection to the pool, discarding it if it is broken."""
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open or failed transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if conn.closed:
+            discard = True
+
+        with self._lock:
+            self._in_use.discard(conn)
+            if discard and not self._closed:
+                self._generation += 1 # Likely not the only broken one; re-validate the others
+            if discard or self._closed:
+                self._discarded += 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def closeall(self):
+        """Closes idle connections and marks the pool closed; in-use ones close on return."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of pool usage counters."""
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total_seconds": round(self._wait_time_total, 6),
+                "wait_time_max_seconds": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "connects": self._connects,
+                "health_check_failures": self._health_check_failures,
+                "discarded": self._discarded,
+                "generation": self._generation,
+                "queries": self._queries.value,
+            }
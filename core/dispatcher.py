@@ -0,0 +1,316 @@
+# gemini_multichat_bot/core/dispatcher.py
+
+import asyncio
+import contextvars
+import threading
+import time
+
+# Deadline (time.monotonic()) of the message being handled, set by the dispatcher while
+# its handler runs so that core can bound the work done for it; None if there is none.
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+# Weight of the newest handler duration in the smoothed service time used for admission
+_SERVICE_TIME_SMOOTHING = 0.1
+
+
+class DispatcherBusy(Exception):
+    """Raised when a message cannot be queued because the dispatcher is saturated."""
+
+
+class DeadlineExceeded(DispatcherBusy):
+    """Raised when a message's deadline passes (or would pass) before it can be answered."""
+
+
+def time_left():
+    """Seconds until the current message's deadline (negative once passed), or None."""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class _UserQueue:
+    __slots__ = ("pending", "running")
+
+    def __init__(self):
+        self.pending = [] # (text, handler, future, submitted_monotonic, start_by, deadline)
+        self.running = False
+
+
+class ChatDispatcher:
+    """
+    Runs chat generations with per-user ordering and a global concurrency limit.
+
+    Each user's messages are handled strictly one after another, so a turn always sees
+    the history written by the previous one. At most max_concurrent handlers run at once
+    across all users. When max_queued messages are already waiting, new submissions wait
+    up to queue_timeout seconds for room (backpressure) and then fail with
+    DispatcherBusy; a single user may not have more than max_queued_per_user waiting.
+
+    Admission control: a message may carry a deadline (time.monotonic() after which
+    nobody will read the reply). It must start within max_queue_wait seconds of being
+    submitted and with at least min_budget seconds left before its deadline; otherwise
+    it is shed with DeadlineExceeded instead of running a generation nobody will see.
+    Messages are also shed on arrival when the expected queue wait (smoothed handler
+    duration x queue depth / max_concurrent) already exceeds that allowance. While the
+    handler runs, request_deadline holds the deadline. Shed messages are counted by reason.
+
+    With coalesce=True, messages a user sends while an earlier one is still being
+    answered are merged into a single model call; the merged reply is returned to the
+    latest submission and the earlier ones resolve to None.
+
+    The dispatcher lives on one asyncio event loop (the first one that submits to it,
+    or one bound explicitly with bind_loop). Synchronous callers such as the Flask
+    WhatsApp webhook use submit_threadsafe(), which starts a background loop if needed.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 200, max_queued_per_user: int = 5,
+                 queue_timeout: float = 10.0, coalesce: bool = False, max_queue_wait: float = 0.0,
+                 min_budget: float = 0.0):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.coalesce = coalesce
+        self.max_queue_wait = max_queue_wait # 0: no limit
+        self.min_budget = min_budget
+
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._semaphore = None
+        self._space = None
+        self._users = {}
+        self._queued = 0
+        self._in_flight = 0
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._coalesced = 0
+        self._shed_lock = threading.Lock() # record_shed is also called from other threads
+        self._shed = {
+            "user_queue_full": 0,
+            "queue_full": 0,
+            "expired_on_arrival": 0,
+            "predicted_late": 0,
+            "expired_in_queue": 0,
+            "generation_deadline": 0,
+        }
+        self._service_time = None
+        self._backpressure_waits = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    def bind_loop(self, loop):
+        """Binds the dispatcher to an event loop; call before any submission."""
+        with self._loop_lock:
+            if self._loop is not None and self._loop is not loop:
+                raise RuntimeError("ChatDispatcher is already bound to another event loop.")
+            self._loop = loop
+
+    def _ensure_background_loop(self):
+        with self._loop_lock:
+            if self._loop is not None and not self._loop.is_closed():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="core-dispatch", daemon=True)
+            thread.start()
+            self._loop = loop
+            return loop
+
+    def start_background_loop(self):
+        """
+        Runs the dispatcher on its own thread's event loop (unless it is already bound),
+        so handlers never share a loop with a latency-sensitive caller such as a gateway.
+        """
+        return self._ensure_background_loop()
+
+    def record_shed(self, reason: str):
+        """Counts a message dropped for `reason` (also used by core for generations cut short)."""
+        with self._shed_lock:
+            self._shed[reason] = self._shed.get(reason, 0) + 1
+
+    def _start_by(self, submitted: float, deadline: float):
+        """Latest time a message submitted at `submitted` may still start; None if unbounded."""
+        limits = []
+        if self.max_queue_wait:
+            limits.append(submitted + self.max_queue_wait)
+        if deadline is not None:
+            limits.append(deadline - self.min_budget)
+        return min(limits) if limits else None
+
+    def _expected_wait(self) -> float:
+        if self._service_time is None or self._in_flight < self.max_concurrent:
+            return 0.0
+        return self._service_time * (self._queued + 1) / self.max_concurrent
+
+    async def submit(self, user_id: str, text: str, handler, deadline: float = None):
+        """
+        Queues `text` for user_id and returns `await handler(text)` once it is this
+        message's turn (or None if it was coalesced into a later message). `deadline`
+        is a time.monotonic() value after which the reply is no longer useful.
+        """
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = loop
+        if self._loop is not loop:
+            # Submitted from another loop/thread: run on the dispatcher's own loop
+            future = asyncio.run_coroutine_threadsafe(self.submit(user_id, text, handler, deadline), self._loop)
+            return await asyncio.wrap_future(future)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._space = asyncio.Condition()
+
+        submitted = time.monotonic()
+        start_by = self._start_by(submitted, deadline)
+        if start_by is not None:
+            if start_by <= submitted:
+                self.record_shed("expired_on_arrival")
+                raise DeadlineExceeded("Message arrived after its deadline.")
+            if submitted + self._expected_wait() > start_by:
+                self.record_shed("predicted_late")
+                raise DeadlineExceeded("Message would not start before its deadline.")
+
+        queue = self._users.get(user_id)
+        if queue is not None and len(queue.pending) >= self.max_queued_per_user:
+            self.record_shed("user_queue_full")
+            raise DispatcherBusy(f"Too many messages queued for user {user_id}.")
+        if self._queued >= self.max_queued:
+            self._backpressure_waits += 1
+            wait = self.queue_timeout if start_by is None else min(self.queue_timeout, start_by - submitted)
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: self._queued < self.max_queued),
+                        wait,
+                    )
+            except asyncio.TimeoutError:
+                self.record_shed("queue_full")
+                raise DispatcherBusy("Dispatcher queue is full.")
+
+        future = loop.create_future()
+        queue = self._users.setdefault(user_id, _UserQueue())
+        queue.pending.append((text, handler, future, submitted, start_by, deadline))
+        self._queued += 1
+        self._submitted += 1
+        if not queue.running:
+            queue.running = True
+            loop.create_task(self._drain(user_id, queue))
+        return await future
+
+    def submit_threadsafe(self, user_id: str, text: str, handler, timeout: float = None, deadline: float = None):
+        """Blocking submit() for code that is not running on an event loop."""
+        loop = self._ensure_background_loop()
+        future = asyncio.run_coroutine_threadsafe(self.submit(user_id, text, handler, deadline), loop)
+        return future.result(timeout)
+
+    def submit_background(self, user_id: str, text: str, handler, deadline: float = None):
+        """
+        Non-blocking submit() for synchronous code: returns a concurrent.futures.Future
+        right away. DispatcherBusy and handler errors are reported through the future.
+        """
+        loop = self._ensure_background_loop()
+        return asyncio.run_coroutine_threadsafe(self.submit(user_id, text, handler, deadline), loop)
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Waits until nothing is queued or running; returns False if timeout ran out first."""
+        deadline = time.monotonic() + timeout
+        while self._queued or self._in_flight or self._users:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def _release_queued(self, count: int):
+        self._queued -= count
+        async with self._space:
+            self._space.notify_all()
+
+    async def _drain(self, user_id: str, queue: _UserQueue):
+        batch = []
+        try:
+            while queue.pending:
+                async with self._semaphore:
+                    if self.coalesce:
+                        batch, queue.pending = queue.pending, []
+                    else:
+                        batch = [queue.pending.pop(0)]
+                    await self._release_queued(len(batch))
+                    batch = [entry for entry in batch if not entry[2].cancelled()]
+                    now = time.monotonic()
+                    for entry in batch:
+                        waited = now - entry[3]
+                        self._queue_wait_total += waited
+                        self._queue_wait_max = max(self._queue_wait_max, waited)
+                    live = []
+                    for entry in batch:
+                        if entry[4] is not None and now > entry[4]:
+                            self.record_shed("expired_in_queue")
+                            entry[2].set_exception(DeadlineExceeded("Message waited past its deadline."))
+                        else:
+                            live.append(entry)
+                    batch = live
+                    if not batch:
+                        continue
+                    self._coalesced += len(batch) - 1
+
+                    text = "\n".join(entry[0] for entry in batch)
+                    handler = batch[-1][1] # Reply to the most recent message
+                    deadlines = [entry[5] for entry in batch if entry[5] is not None]
+                    deadline_token = request_deadline.set(min(deadlines) if deadlines else None)
+                    self._in_flight += 1
+                    started = time.monotonic()
+                    try:
+                        result = await handler(text)
+                    except Exception as e:
+                        self._failed += 1
+                        for entry in batch:
+                            if not entry[2].done():
+                                entry[2].set_exception(e)
+                    else:
+                        self._completed += 1
+                        for entry in batch[:-1]:
+                            if not entry[2].done():
+                                entry[2].set_result(None)
+                        if not batch[-1][2].done():
+                            batch[-1][2].set_result(result)
+                    finally:
+                        self._in_flight -= 1
+                        request_deadline.reset(deadline_token)
+                        duration = time.monotonic() - started
+                        self._service_time = duration if self._service_time is None else (
+                            (1 - _SERVICE_TIME_SMOOTHING) * self._service_time + _SERVICE_TIME_SMOOTHING * duration
+                        )
+        finally:
+            # Only left over when the drain is cancelled (e.g. the loop shuts down): cancel
+            # those submissions instead of leaving their callers waiting forever.
+            for entry in batch:
+                entry[2].cancel()
+            if queue.pending:
+                self._queued -= len(queue.pending)
+                for entry in queue.pending:
+                    entry[2].cancel()
+                queue.pending = []
+            queue.running = False
+            if self._users.get(user_id) is queue and not queue.pending:
+                del self._users[user_id]
+
+    def stats(self) -> dict:
+        with self._shed_lock:
+            shed = dict(self._shed)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "active_users": len(self._users),
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "coalesced": self._coalesced,
+            "rejected": sum(shed.values()),
+            "shed": shed,
+            "service_time_seconds": round(self._service_time or 0.0, 6),
+            "backpressure_waits": self._backpressure_waits,
+            "queue_wait_total_seconds": round(self._queue_wait_total, 6),
+            "queue_wait_max_seconds": round(self._queue_wait_max, 6),
+        }
@@ -0,0 +1,153 @@
+# gemini_multichat_bot/core/fake_model.py
+
+import asyncio
+import os
+import random
+import time
+
+
+class FakeModelError(Exception):
+    """Injected upstream error. Marked retryable like a 503 from the real service."""
+    retryable = True
+
+
+class FakeQuotaError(FakeModelError):
+    """Injected quota (429) error."""
+
+
+class FakeInvalidRequestError(Exception):
+    """Injected non-retryable error, like a 400 from the real service."""
+
+
+class _UsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int):
+        self.text = text
+        self.usage_metadata = _UsageMetadata(prompt_tokens, max(1, len(text) // 4))
+
+
+class _FakeStream:
+    """Iterable (sync and async) over response chunks, like GenerateContentResponse with stream=True."""
+
+    def __init__(self, model, chunks: list, prompt_tokens: int):
+        self._model = model
+        self._chunks = chunks
+        self.text = "".join(chunks)
+        self.usage_metadata = _UsageMetadata(prompt_tokens, max(1, len(self.text) // 4))
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._model.chunk_delay(chunk))
+            yield FakeResponse(chunk, 0)
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._model.chunk_delay(chunk))
+            yield FakeResponse(chunk, 0)
+
+
+def _content_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    texts = []
+    for content in contents:
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(str(part) for part in content.get("parts", []))
+    return "\n".join(texts)
+
+
+class FakeGenerativeModel:
+    """
+    Local stand-in for genai.GenerativeModel with the same generate_content /
+    generate_content_async interface, for resilience tests and benchmarks.
+
+    latency: seconds before the first token; tokens_per_second: output speed (0 means
+    instant); error_rate / quota_error_rate / invalid_error_rate: probability of raising
+    FakeModelError (retryable 5xx-like), FakeQuotaError (retryable 429-like) or
+    FakeInvalidRequestError (non-retryable) instead of answering.
+    """
+
+    def __init__(self, model_name: str = "fake-gemini", latency: float = 0.2, tokens_per_second: float = 0.0,
+                 reply_tokens: int = 60, error_rate: float = 0.0, quota_error_rate: float = 0.0,
+                 invalid_error_rate: float = 0.0, seed: int = None):
+        self.model_name = model_name
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.invalid_error_rate = invalid_error_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, model_name: str = "fake-gemini"):
+        """Builds a fake from FAKE_MODEL_* environment variables."""
+        return cls(
+            model_name=model_name,
+            latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.2")),
+            tokens_per_second=float(os.getenv("FAKE_MODEL_TOKENS_PER_SECOND", "0")),
+            reply_tokens=int(os.getenv("FAKE_MODEL_REPLY_TOKENS", "60")),
+            error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")),
+            quota_error_rate=float(os.getenv("FAKE_MODEL_QUOTA_ERROR_RATE", "0")),
+            invalid_error_rate=float(os.getenv("FAKE_MODEL_INVALID_ERROR_RATE", "0")),
+        )
+
+    def chunk_delay(self, chunk: str) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return max(1, len(chunk) // 4) / self.tokens_per_second
+
+    def _maybe_fail(self):
+        roll = self._random.random()
+        if roll < self.error_rate:
+            raise FakeModelError("503 Injected upstream failure")
+        roll -= self.error_rate
+        if roll < self.quota_error_rate:
+            raise FakeQuotaError("429 Injected quota exhaustion")
+        roll -= self.quota_error_rate
+        if roll < self.invalid_error_rate:
+            raise FakeInvalidRequestError("400 Injected invalid request")
+
+    def _reply_chunks(self, prompt: str) -> list:
+        last_line = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        words = [f"word{i}" for i in range(self.reply_tokens)]
+        text = f"Echo: {last_line[:80]} " + " ".join(words)
+        # Roughly 20-token chunks, like the real streaming API
+        return [text[i:i + 80] for i in range(0, len(text), 80)]
+
+    def _respond(self, contents, stream: bool):
+        self.calls += 1
+        prompt = _content_text(contents)
+        prompt_tokens = max(1, len(prompt) // 4)
+        chunks = self._reply_chunks(prompt)
+        if stream:
+            return _FakeStream(self, chunks, prompt_tokens)
+        return FakeResponse("".join(chunks), prompt_tokens)
+
+    def _generation_time(self) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return self.reply_tokens / self.tokens_per_second
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        time.sleep(self.latency)
+        self._maybe_fail()
+        if not stream:
+            time.sleep(self._generation_time())
+        return self._respond(contents, stream)
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        if not stream:
+            await asyncio.sleep(self._generation_time())
+        return self._respond(contents, stream)
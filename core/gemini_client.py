@@ -0,0 +1,88 @@
+# gemini_multichat_bot/core/gemini_client.py
+
+import asyncio
+import threading
+
+
+def _to_contents(contents) -> list:
+    """generate_content() `contents` (a string or [{"role", "parts": [str]}]) as request dicts."""
+    if isinstance(contents, str):
+        return [{"role": "user", "parts": [{"text": contents}]}]
+    converted = []
+    for content in contents:
+        if isinstance(content, str):
+            converted.append({"role": "user", "parts": [{"text": content}]})
+            continue
+        parts = [{"text": part} if isinstance(part, str) else part for part in content.get("parts", [])]
+        converted.append({"role": content.get("role") or "user", "parts": parts})
+    return converted
+
+
+class KeyedGeminiModel:
+    """
+    A Gemini model with an API key of its own, for GEMINI_BACKENDS entries that do not use
+    GEMINI_API_KEY: genai.configure() sets one key for the whole process, so these talk to
+    the API through their own google.ai.generativelanguage clients (configured with public
+    client_options) and wrap replies in the SDK's response types. Same generate_content /
+    generate_content_async interface as genai.GenerativeModel for what core uses.
+
+    The gRPC async client is tied to the event loop it was created on, so it is created
+    on first use from the running loop (and again if called from another loop).
+    """
+
+    def __init__(self, model_name: str, api_key: str, generation_config: dict = None,
+                 safety_settings: list = None, system_instruction: str = None):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.client_options = {"api_key": api_key}
+        self.generation_config = dict(generation_config or {})
+        self.safety_settings = list(safety_settings or [])
+        self.system_instruction = system_instruction
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+
+    def _request(self, contents, generation_config: dict = None):
+        from google.ai import generativelanguage as glm
+        return glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=_to_contents(contents),
+            generation_config={**self.generation_config, **(generation_config or {})},
+            safety_settings=self.safety_settings,
+            system_instruction={"parts": [{"text": self.system_instruction}]} if self.system_instruction else None,
+        )
+
+    def _sync_client(self):
+        with self._lock:
+            if self._client is None:
+                from google.ai import generativelanguage as glm
+                self._client = glm.GenerativeServiceClient(client_options=self.client_options)
+            return self._client
+
+    def _loop_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_client is None or self._async_loop is not loop:
+                from google.ai import generativelanguage as glm
+                self._async_client = glm.GenerativeServiceAsyncClient(client_options=self.client_options)
+                self._async_loop = loop
+            return self._async_client
+
+    def generate_content(self, contents, stream: bool = False, generation_config: dict = None, **kwargs):
+        from google.generativeai.types import GenerateContentResponse
+        if not contents:
+            raise TypeError("contents must not be empty")
+        request = self._request(contents, generation_config)
+        if stream:
+            return GenerateContentResponse.from_iterator(self._sync_client().stream_generate_content(request))
+        return GenerateContentResponse.from_response(self._sync_client().generate_content(request))
+
+    async def generate_content_async(self, contents, stream: bool = False, generation_config: dict = None, **kwargs):
+        from google.generativeai.types import AsyncGenerateContentResponse
+        if not contents:
+            raise TypeError("contents must not be empty")
+        request = self._request(contents, generation_config)
+        client = self._loop_client()
+        if stream:
+            return await AsyncGenerateContentResponse.from_aiterator(await client.stream_generate_content(request))
+        return AsyncGenerateContentResponse.from_response(await client.generate_content(request))
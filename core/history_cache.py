@@ -0,0 +1,152 @@
+# gemini_multichat_bot/core/history_cache.py
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-message bookkeeping cost (dicts, list, key) on top of the text itself
+_MESSAGE_OVERHEAD_BYTES = 200
+
+
+def _record_size(record: dict) -> int:
+    return _MESSAGE_OVERHEAD_BYTES + sys.getsizeof(record["content"])
+
+
+class _Entry:
+    __slots__ = ("records", "summary", "size", "expires_at")
+
+    def __init__(self, records: list, summary, expires_at: float):
+        self.records = records
+        self.summary = summary
+        self.size = sum(_record_size(r) for r in records)
+        if summary:
+            self.size += _MESSAGE_OVERHEAD_BYTES + sys.getsizeof(summary[0])
+        self.expires_at = expires_at
+
+
+class HistoryCache:
+    """
+    Thread-safe LRU cache of each user's recent history window: the chronological
+    {"id", "role", "content"} records plus the stored rolling summary, if any.
+
+    Entries expire after ttl_seconds and the least recently used users are
+    evicted once the cached messages exceed max_bytes. Writers call append()
+    (write-through) so a hot conversation never has to be re-read from the DB.
+    """
+
+    def __init__(self, max_messages: int, ttl_seconds: float, max_bytes: int):
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # user_id -> True if a write happened while a DB load for that user was in flight
+        self._loading = {}
+        self._load_counts = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, user_id: str):
+        """Returns (records copy, summary) for a cached user, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(user_id)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return list(entry.records), entry.summary
+
+    def begin_load(self, user_id: str):
+        """Marks that the caller is about to load this user's window from the DB."""
+        with self._lock:
+            self._load_counts[user_id] = self._load_counts.get(user_id, 0) + 1
+            self._loading.setdefault(user_id, False)
+
+    def end_load(self, user_id: str, records, summary=None):
+        """
+        Stores a window loaded from the DB, unless a write for this user raced
+        with the load (the loaded window would then be missing that write).
+        Pass records=None if the load failed.
+        """
+        with self._lock:
+            raced = self._loading.get(user_id, False)
+            remaining = self._load_counts.get(user_id, 1) - 1
+            if remaining <= 0:
+                self._load_counts.pop(user_id, None)
+                self._loading.pop(user_id, None)
+            else:
+                self._load_counts[user_id] = remaining
+            if records is None or raced:
+                return
+            self._store(user_id, list(records)[-self.max_messages:], summary)
+
+    def append(self, user_id: str, records: list):
+        """Write-through: adds newly saved records to a cached window, if there is one."""
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id] = True
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            self._store(user_id, (entry.records + list(records))[-self.max_messages:], entry.summary)
+
+    def set_summary(self, user_id: str, summary):
+        """Write-through for the rolling summary: (text, summarized_through_id)."""
+        with self._lock:
+            if user_id in self._loading:
+                self._loading[user_id] = True
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            self._store(user_id, entry.records, summary)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, user_id: str, records: list, summary):
+        if user_id in self._entries:
+            self._remove(user_id)
+        entry = _Entry(records, summary, time.monotonic() + self.ttl_seconds)
+        if entry.size > self.max_bytes:
+            return # A single window larger than the whole cache is not worth keeping
+        self._entries[user_id] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            oldest_user = next(iter(self._entries))
+            self._remove(oldest_user)
+            self._evictions += 1
+
+    def _remove(self, user_id: str):
+        entry = self._entries.pop(user_id)
+        self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "users": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
@@ -0,0 +1,464 @@
+# gemini_multichat_bot/core/history_store.py
+
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict, deque
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Rough per-message bookkeeping cost in the in-memory store (tuple, deque slot, strings)
+_MEMORY_MESSAGE_OVERHEAD_BYTES = 120
+
+
+class HistoryStoreError(Exception):
+    """Raised by a HistoryStore when the underlying storage fails."""
+
+
+class HistoryStore:
+    """
+    Where chat history and rolling summaries live.
+
+    Records are {"id", "role", "content"} dicts; ids increase with insertion order and
+    are assigned by the store. A summary is (text, summarized_through_id) or None.
+    `remote` tells core whether reads and writes cost a network round trip, i.e. whether
+    the history cache and write-behind queue are worth putting in front of the store.
+    """
+
+    name = "base"
+    remote = False
+
+    def load(self, user_id: str, limit: int):
+        """Returns (the user's most recent `limit` records in chronological order, summary)."""
+        raise NotImplementedError
+
+    def write_rows(self, rows: list):
+        """Inserts (user_id, record, created_at) rows in order and fills in record["id"]."""
+        raise NotImplementedError
+
+    def save_summary(self, user_id: str, summary_text: str, summarized_through_id: int):
+        """Stores a user's rolling summary unless a newer one is already stored."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class PostgresHistoryStore(HistoryStore):
+    """
+    chat_history / chat_summaries in PostgreSQL (schema from core/migrations.py).
+    `connection` is a callable returning a context manager that yields a pooled
+    connection or None, like core.main.db_connection.
+    """
+
+    name = "postgres"
+    remote = True
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _checkout(self):
+        return self.connection()
+
+    def load(self, user_id: str, limit: int):
+        try:
+            with self._checkout() as conn:
+                if not conn:
+                    raise HistoryStoreError("No database connection available.")
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        SELECT id, role, content FROM chat_history
+                        WHERE user_id = %s
+                        ORDER BY timestamp DESC, id DESC
+                        LIMIT %s
+                        """,
+                        (user_id, limit)
+                    )
+                    rows = cur.fetchall()
+                    cur.execute(
+                        "SELECT summary, summarized_through_id FROM chat_summaries WHERE user_id = %s",
+                        (user_id,)
+                    )
+                    summary_row = cur.fetchone()
+                conn.rollback() # End the read-only transaction before the connection goes back to the pool
+        except psycopg2.Error as e:
+            raise HistoryStoreError(str(e)) from e
+        # Fetched newest first; reverse to get chronological order for Gemini
+        records = [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+        return records, (summary_row[0], summary_row[1]) if summary_row else None
+
+    def write_rows(self, rows: list):
+        try:
+            with self._checkout() as conn:
+                if not conn:
+                    raise HistoryStoreError("No database connection available.")
+                with conn.cursor() as cur:
+                    inserted = execute_values(
+                        cur,
+                        "INSERT INTO chat_history (user_id, role, content, timestamp) VALUES %s RETURNING id",
+                        [(user_id, record["role"], record["content"], created_at) for user_id, record, created_at in rows],
+                        page_size=len(rows),
+                        fetch=True,
+                    )
+                conn.commit()
+        except psycopg2.Error as e:
+            raise HistoryStoreError(str(e)) from e
+        # Rows come back in VALUES order; ids are only filled in once the commit succeeded
+        for (_, record, _), row in zip(rows, inserted):
+            record["id"] = row[0]
+
+    def save_summary(self, user_id: str, summary_text: str, summarized_through_id: int):
+        try:
+            with self._checkout() as conn:
+                if not conn:
+                    raise HistoryStoreError("No database connection available.")
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO chat_summaries (user_id, summary, summarized_through_id, updated_at)
+                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET summary = EXCLUDED.summary,
+                            summarized_through_id = EXCLUDED.summarized_through_id,
+                            updated_at = EXCLUDED.updated_at
+                        WHERE chat_summaries.summarized_through_id < EXCLUDED.summarized_through_id
+                        """,
+                        (user_id, summary_text, summarized_through_id)
+                    )
+                conn.commit()
+        except psycopg2.Error as e:
+            raise HistoryStoreError(str(e)) from e
+
+
+class ShardedHistoryStore(HistoryStore):
+    """
+    Chat history spread over several PostgreSQL databases. Each user lives on exactly
+    one shard, picked by consistent hashing of user_id on `ring` (a core.sharding.HashRing),
+    so a user's history, summary and write order never span databases. `shards` maps
+    shard names to PostgresHistoryStore instances, each with its own connection pool.
+
+    While a rebalance is in progress `previous_ring` is the ring before it: a user whose
+    shard differs between the two rings stays on the old shard until tools/rebalance_shards.py
+    has copied them over, which it records in chat_history_moves on the new shard.
+    """
+
+    name = "postgres-sharded"
+    remote = True
+
+    def __init__(self, shards: dict, ring, previous_ring=None):
+        self.shards = shards
+        self.ring = ring
+        self.previous_ring = previous_ring
+        self._lock = threading.Lock()
+        self._moved = set() # Users seen as fully moved; moves are never undone
+        self._counters = {name: {"reads": 0, "rows_written": 0, "errors": 0} for name in shards}
+        self._routed_to_previous = 0
+
+    def _has_moved(self, shard_name: str, user_id: str) -> bool:
+        with self._lock:
+            if user_id in self._moved:
+                return True
+        try:
+            with self.shards[shard_name].connection() as conn:
+                if not conn:
+                    raise HistoryStoreError("No database connection available.")
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1 FROM chat_history_moves WHERE user_id = %s", (user_id,))
+                    moved = cur.fetchone() is not None
+                conn.rollback()
+        except psycopg2.Error as e:
+            raise HistoryStoreError(str(e)) from e
+        if moved:
+            with self._lock:
+                self._moved.add(user_id)
+        return moved
+
+    def shard_for(self, user_id: str) -> str:
+        """Name of the shard currently holding user_id."""
+        owner = self.ring.node_for(user_id)
+        if self.previous_ring is None:
+            return owner
+        previous_owner = self.previous_ring.node_for(user_id)
+        if previous_owner == owner or self._has_moved(owner, user_id):
+            return owner
+        with self._lock:
+            self._routed_to_previous += 1
+        return previous_owner
+
+    def _count(self, shard_name: str, key: str, amount: int = 1):
+        with self._lock:
+            self._counters[shard_name][key] += amount
+
+    def load(self, user_id: str, limit: int):
+        shard_name = self.shard_for(user_id)
+        try:
+            result = self.shards[shard_name].load(user_id, limit)
+        except HistoryStoreError:
+            self._count(shard_name, "errors")
+            raise
+        self._count(shard_name, "reads")
+        return result
+
+    def write_rows(self, rows: list):
+        """
+        Writes each shard's rows in one batch. If a shard fails, the rows already written
+        to the other shards keep their ids, so callers can tell which rows still need writing.
+        """
+        owners = {}
+        by_shard = OrderedDict()
+        for row in rows:
+            if row[0] not in owners:
+                owners[row[0]] = self.shard_for(row[0])
+            by_shard.setdefault(owners[row[0]], []).append(row)
+        failure = None
+        for shard_name, shard_rows in by_shard.items():
+            try:
+                self.shards[shard_name].write_rows(shard_rows)
+            except HistoryStoreError as e:
+                self._count(shard_name, "errors")
+                failure = failure or e
+                continue
+            self._count(shard_name, "rows_written", len(shard_rows))
+        if failure is not None:
+            raise failure
+
+    def save_summary(self, user_id: str, summary_text: str, summarized_through_id: int):
+        shard_name = self.shard_for(user_id)
+        try:
+            self.shards[shard_name].save_summary(user_id, summary_text, summarized_through_id)
+        except HistoryStoreError:
+            self._count(shard_name, "errors")
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"shards": {name: dict(counters) for name, counters in self._counters.items()}}
+            if self.previous_ring is not None:
+                stats["rebalance"] = {"moved_users_seen": len(self._moved), "routed_to_previous": self._routed_to_previous}
+        return stats
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    History in a local SQLite file in WAL mode: readers never block the writer and
+    commits do not fsync the main database file, so a single node gets durable
+    history without any network round trip. One connection per thread.
+    """
+
+    name = "sqlite"
+    remote = False
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user_recent ON chat_history (user_id, id DESC)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_through_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+    )
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._connections = [] # Every thread's connection, so close() can reach them all
+        self._generation = 0 # Bumped by close(); threads reconnect if theirs is older
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation != self._generation:
+            conn = None # Closed by close() from another thread
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            # Only used by this thread, but close() may close it from another one
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; only the last commits can be lost on power failure
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+                self._connections.append(conn)
+                self._local.generation = self._generation
+            self._local.conn = conn
+        return conn
+
+    def load(self, user_id: str, limit: int):
+        try:
+            conn = self._conn()
+            rows = conn.execute(
+                "SELECT id, role, content FROM chat_history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+            summary_row = conn.execute(
+                "SELECT summary, summarized_through_id FROM chat_summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise HistoryStoreError(str(e)) from e
+        records = [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+        return records, (summary_row[0], summary_row[1]) if summary_row else None
+
+    def write_rows(self, rows: list):
+        conn = None
+        ids = []
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            for user_id, record, created_at in rows:
+                cursor = conn.execute(
+                    "INSERT INTO chat_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    (user_id, record["role"], record["content"], created_at.isoformat())
+                )
+                ids.append(cursor.lastrowid)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn is not None and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise HistoryStoreError(str(e)) from e
+        for (_, record, _), row_id in zip(rows, ids):
+            record["id"] = row_id
+
+    def save_summary(self, user_id: str, summary_text: str, summarized_through_id: int):
+        try:
+            self._conn().execute(
+                """
+                INSERT INTO chat_summaries (user_id, summary, summarized_through_id, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE
+                SET summary = excluded.summary,
+                    summarized_through_id = excluded.summarized_through_id,
+                    updated_at = excluded.updated_at
+                WHERE chat_summaries.summarized_through_id < excluded.summarized_through_id
+                """,
+                (user_id, summary_text, summarized_through_id,
+                 datetime.datetime.now(datetime.timezone.utc).isoformat())
+            )
+        except sqlite3.Error as e:
+            raise HistoryStoreError(str(e)) from e
+
+    def close(self):
+        with self._schema_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+        self._local.conn = None
+
+
+class _MemoryUser:
+    __slots__ = ("messages", "summary", "size")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages) # (id, role, content)
+        self.summary = None
+        self.size = 0
+
+
+class MemoryHistoryStore(HistoryStore):
+    """
+    Process-local history: a fixed-size ring buffer (deque) of compact (id, role, content)
+    tuples per user plus a global byte cap, past which the least recently active users
+    are dropped. Nothing survives a restart and nothing is shared between processes, so
+    it suits single-node deployments, development and benchmarks.
+    """
+
+    name = "memory"
+    remote = False
+
+    def __init__(self, max_messages_per_user: int = 50, max_bytes: int = 64 * 1024 * 1024):
+        if max_messages_per_user < 1:
+            raise ValueError("max_messages_per_user must be at least 1")
+        self.max_messages_per_user = max_messages_per_user
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._bytes = 0
+        self._next_id = 1
+        self._evicted_users = 0
+
+    @staticmethod
+    def _message_size(content: str) -> int:
+        return _MEMORY_MESSAGE_OVERHEAD_BYTES + sys.getsizeof(content)
+
+    def load(self, user_id: str, limit: int):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return [], None
+            self._users.move_to_end(user_id)
+            messages = list(user.messages)[-limit:] if limit else []
+            summary = user.summary
+        return [{"id": m[0], "role": m[1], "content": m[2]} for m in messages], summary
+
+    def write_rows(self, rows: list):
+        with self._lock:
+            for user_id, record, _ in rows:
+                user = self._users.get(user_id)
+                if user is None:
+                    user = self._users[user_id] = _MemoryUser(self.max_messages_per_user)
+                else:
+                    self._users.move_to_end(user_id)
+                if len(user.messages) == user.messages.maxlen:
+                    dropped = user.messages[0] # Pushed out of the ring buffer by the append below
+                    user.size -= self._message_size(dropped[2])
+                    self._bytes -= self._message_size(dropped[2])
+                record["id"] = self._next_id
+                self._next_id += 1
+                user.messages.append((record["id"], record["role"], record["content"]))
+                size = self._message_size(record["content"])
+                user.size += size
+                self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        # Least recently active users go first; the most recent one is always kept
+        while self._bytes > self.max_bytes and len(self._users) > 1:
+            _, user = self._users.popitem(last=False)
+            self._bytes -= user.size
+            self._evicted_users += 1
+
+    def save_summary(self, user_id: str, summary_text: str, summarized_through_id: int):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return # The user was evicted; the summary would point at messages that are gone
+            if user.summary is None or user.summary[1] < summarized_through_id:
+                old_size = sys.getsizeof(user.summary[0]) if user.summary else 0
+                user.summary = (summary_text, summarized_through_id)
+                delta = sys.getsizeof(summary_text) - old_size
+                user.size += delta
+                self._bytes += delta
+                self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evicted_users": self._evicted_users,
+            }
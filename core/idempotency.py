@@ -0,0 +1,116 @@
+# gemini_multichat_bot/core/idempotency.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Claim:
+    __slots__ = ("expires_at", "done", "reply")
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+        self.done = False
+        self.reply = None
+
+
+class MessageDeduplicator:
+    """
+    Makes webhook processing idempotent per provider message id (e.g. Twilio's MessageSid).
+
+    claim(message_id, user_id) returns (True, None) the first time a message id is seen
+    and (False, reply) for every redelivery, where reply is the stored answer or None while
+    the first delivery is still being processed. Seen ids are kept in memory for
+    ttl_seconds (at most max_entries of them). The optional claim_remote / fetch_remote /
+    complete_remote / release_remote callables back this with a shared store (a unique
+    key in the database) so retries that land on another worker are caught too;
+    claim_remote returns True (claimed), False (already claimed) or None (store
+    unavailable, in which case the in-memory answer is used).
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 100000, claim_remote=None,
+                 fetch_remote=None, complete_remote=None, release_remote=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.claim_remote = claim_remote
+        self.fetch_remote = fetch_remote
+        self.complete_remote = complete_remote
+        self.release_remote = release_remote
+        self._lock = threading.Lock()
+        self._claims = OrderedDict()
+
+        self._claimed = 0
+        self._suppressed = 0
+        self._suppressed_in_progress = 0
+        self._replayed_replies = 0
+        self._remote_duplicates = 0
+        self._released = 0
+
+    def _prune(self, now: float):
+        # All entries share one TTL, so insertion order is also expiry order
+        while self._claims:
+            message_id, claim = next(iter(self._claims.items()))
+            if claim.expires_at > now and len(self._claims) < self.max_entries:
+                break
+            del self._claims[message_id]
+
+    def _suppress(self, reply):
+        self._suppressed += 1
+        if reply is None:
+            self._suppressed_in_progress += 1
+        else:
+            self._replayed_replies += 1
+        return False, reply
+
+    def claim(self, message_id: str, user_id: str):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            claim = self._claims.get(message_id)
+            if claim is not None:
+                return self._suppress(claim.reply if claim.done else None)
+            self._claims[message_id] = _Claim(now + self.ttl_seconds)
+
+        if self.claim_remote is not None and self.claim_remote(message_id, user_id) is False:
+            reply = self.fetch_remote(message_id) if self.fetch_remote is not None else None
+            with self._lock:
+                self._remote_duplicates += 1
+                claim = self._claims.get(message_id)
+                if claim is not None and reply is not None:
+                    claim.done = True
+                    claim.reply = reply
+                return self._suppress(reply)
+
+        with self._lock:
+            self._claimed += 1
+        return True, None
+
+    def complete(self, message_id: str, reply: str = None):
+        """Marks a claimed message as answered; reply is handed to later redeliveries."""
+        with self._lock:
+            claim = self._claims.get(message_id)
+            if claim is not None:
+                claim.done = True
+                claim.reply = reply
+        if self.complete_remote is not None:
+            self.complete_remote(message_id, reply)
+
+    def release(self, message_id: str):
+        """Forgets a claim whose processing failed, so a redelivery is handled again."""
+        with self._lock:
+            self._claims.pop(message_id, None)
+            self._released += 1
+        if self.release_remote is not None:
+            self.release_remote(message_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked": len(self._claims),
+                "claimed": self._claimed,
+                "duplicates_suppressed": self._suppressed,
+                "duplicates_in_progress": self._suppressed_in_progress,
+                "cached_replies_returned": self._replayed_replies,
+                "remote_duplicates": self._remote_duplicates,
+                "released": self._released,
+            }
@@ -0,0 +1,247 @@
+# gemini_multichat_bot/core/metrics.py
+
+import contextvars
+import json
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_INF_LABEL = 'le="+Inf"'
+
+# Platform of the chat turn being handled, so spans deep in the call stack (e.g. the
+# DB connection checkout) are tagged without passing it through every function.
+current_platform = contextvars.ContextVar("current_platform", default="unknown")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {} # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(float(series[-2]))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus text-format registry: counters, histograms, and gauges read
+    from existing stats() functions at scrape time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._stats_sources = [] # (prefix, stats_fn)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, stats_fn):
+        """Exports every numeric value of stats_fn() (nested dicts flattened) as a gauge named prefix_key."""
+        with self._lock:
+            self._stats_sources.append((prefix, stats_fn))
+
+    def _stats_lines(self, prefix: str, stats: dict) -> list:
+        lines = []
+        for key, value in stats.items():
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{key}") # Keys may be e.g. model names
+            if isinstance(value, dict):
+                lines.extend(self._stats_lines(name, value))
+            elif isinstance(value, (int, float)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(int(value) if isinstance(value, bool) else value)}")
+        return lines
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            sources = list(self._stats_sources)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in sources:
+            try:
+                lines.extend(self._stats_lines(prefix, stats_fn() or {}))
+            except Exception as e: # A broken stats source must not break the whole scrape
+                lines.append(f"# {prefix} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "chat_stage_duration_seconds",
+    "Time spent in each stage of a chat turn (connect, fetch, generate, save).",
+    ("stage", "platform", "outcome"),
+)
+turn_duration = registry.histogram(
+    "chat_turn_duration_seconds",
+    "End-to-end time to produce a reply, by the path the turn took (history, no_history, simple_fallback, unavailable...).",
+    ("platform", "path"),
+)
+prompt_tokens = registry.counter(
+    "gemini_prompt_tokens_total", "Prompt tokens sent to Gemini.", ("platform",)
+)
+output_tokens = registry.counter(
+    "gemini_output_tokens_total", "Output tokens generated by Gemini.", ("platform",)
+)
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "ok"):
+    stage_duration.observe(seconds, stage=stage, platform=current_platform.get(), outcome=outcome)
+
+
+@contextmanager
+def span(stage: str):
+    """Times a stage of the current chat turn; outcome is "error" if the block raises."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe_stage(stage, time.perf_counter() - started, outcome)
+
+
+class _Turn:
+    __slots__ = ("platform", "path")
+
+    def __init__(self, platform: str):
+        self.platform = platform
+        self.path = "error" # Overwritten by the code path that produces the reply
+
+
+@contextmanager
+def turn(platform: str = None):
+    """Times a whole chat turn and tags the spans inside it with the platform."""
+    platform = platform or current_platform.get()
+    token = current_platform.set(platform)
+    current = _Turn(platform)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        turn_duration.observe(time.perf_counter() - started, platform=platform, path=current.path)
+        try:
+            current_platform.reset(token)
+        except ValueError: # Exited from another context, e.g. an async generator closed elsewhere
+            pass
+
+
+def record_tokens(prompt_count: int, output_count: int):
+    platform = current_platform.get()
+    if prompt_count:
+        prompt_tokens.inc(prompt_count, platform=platform)
+    if output_count:
+        output_tokens.inc(output_count, platform=platform)
+
+
+def start_http_server(port: int, health_check, host: str = "0.0.0.0"):
+    """
+    Serves /metrics and /healthz on a daemon thread, for processes without a web app
+    (the Telegram and Discord workers). health_check() returns (healthy, details dict).
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] == "/metrics":
+                status, content_type, body = 200, PROMETHEUS_CONTENT_TYPE, registry.render()
+            elif self.path.split("?")[0] == "/healthz":
+                healthy, details = health_check()
+                status, content_type, body = (200 if healthy else 503), "application/json", json.dumps(details)
+            else:
+                status, content_type, body = 404, "text/plain", "Not found\n"
+            payload = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would drown the bot's own logs
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
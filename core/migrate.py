@@ -0,0 +1,59 @@
+# gemini_multichat_bot/core/migrate.py
+#
+# One-shot schema migration step, run before the bots start (e.g. in a deploy or
+# release command) instead of on every process start:
+#
+#     python -m core.migrate            # apply all pending migrations
+#     python -m core.migrate --status   # print current and latest schema version
+#     python -m core.migrate --target 2 # apply migrations up to version 2
+#
+# DATABASE_URL and every database in HISTORY_SHARDS are migrated, one after another.
+
+import argparse
+import logging
+import sys
+
+import psycopg2
+
+from core import main as core_logic
+from core.migrations import LATEST_SCHEMA_VERSION, apply_migrations, get_schema_version
+
+logger = logging.getLogger("core_migrate")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply pending chat_history schema migrations.")
+    parser.add_argument("--target", type=int, default=None,
+                        help=f"Schema version to migrate to (default: latest, {LATEST_SCHEMA_VERSION}).")
+    parser.add_argument("--status", action="store_true", help="Only print the current schema version.")
+    args = parser.parse_args(argv)
+
+    databases = core_logic.database_connections(logger)
+    if not databases:
+        # Not an error: the bots run without a database (in-memory or local history)
+        logger.info("Neither DATABASE_URL nor HISTORY_SHARDS is set; nothing to migrate.")
+        return 0
+
+    try:
+        for label, connection in databases:
+            with connection() as conn:
+                if not conn:
+                    return 1
+                if args.status:
+                    version = get_schema_version(conn)
+                    conn.rollback()
+                    print(f"{label}: schema version {version} (latest {LATEST_SCHEMA_VERSION}).")
+                    continue
+                version = apply_migrations(conn, logger, target_version=args.target)
+            logger.info(f"Schema of {label} is at version {version}.")
+    except psycopg2.Error as e:
+        logger.error(f"Schema migration failed: {e}")
+        return 1
+    finally:
+        core_logic.close_db_pool()
+        core_logic.close_shard_pools()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
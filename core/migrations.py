@@ -0,0 +1,236 @@
+# gemini_multichat_bot/core/migrations.py
+
+import time
+
+import psycopg2
+
+# Arbitrary constant used with pg_advisory_lock so that several services starting at
+# once (WhatsApp, Telegram, Discord) do not run the same migration concurrently.
+MIGRATION_LOCK_KEY = 7_316_452_001
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+
+# Ordered list of (version, description, statements, transactional).
+# Never edit a migration that has shipped; append a new one instead.
+# Non-transactional migrations run in autocommit mode, which is required for
+# CREATE INDEX CONCURRENTLY (it does not block inserts while the index builds).
+SCHEMA_MIGRATIONS = [
+    (
+        1,
+        "create chat_history table",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id SERIAL PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+        ],
+        True,
+    ),
+    (
+        2,
+        "index chat_history by user and recency",
+        [
+            # A previous interrupted CONCURRENTLY build leaves an INVALID index behind,
+            # which IF NOT EXISTS would silently accept; drop it first.
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = 'idx_chat_history_user_recent' AND NOT i.indisvalid
+                ) THEN
+                    DROP INDEX idx_chat_history_user_recent;
+                END IF;
+            END $$;
+            """,
+            # `id` is the monotonic tie-breaker: both messages of a turn are written in
+            # one transaction and therefore share the same CURRENT_TIMESTAMP.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_history_user_recent
+                ON chat_history (user_id, timestamp DESC, id DESC);
+            """,
+        ],
+        False,
+    ),
+    (
+        3,
+        "create chat_summaries table for rolling summaries",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS chat_summaries (
+                user_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summarized_through_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+        ],
+        True,
+    ),
+    (
+        4,
+        "create processed_messages table for webhook deduplication",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS processed_messages (
+                message_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                reply TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP
+            );
+            """,
+            # Lets old rows be pruned without a full table scan
+            """
+            CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at
+                ON processed_messages (created_at);
+            """,
+        ],
+        True,
+    ),
+    (
+        5,
+        "index chat_history by timestamp for age-based retention",
+        [
+            """
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = 'idx_chat_history_timestamp' AND NOT i.indisvalid
+                ) THEN
+                    DROP INDEX idx_chat_history_timestamp;
+                END IF;
+            END $$;
+            """,
+            # Lets the retention job find expired rows without scanning the table
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_history_timestamp
+                ON chat_history (timestamp);
+            """,
+        ],
+        False,
+    ),
+    (
+        6,
+        "create response_cache table for the shared response cache tier",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            );
+            """,
+            # Lets the retention job delete expired entries without a full table scan
+            """
+            CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at
+                ON response_cache (expires_at);
+            """,
+        ],
+        True,
+    ),
+    (
+        7,
+        "create chat_history_moves table for rebalancing history shards",
+        [
+            # One row per user copied onto this shard by tools/rebalance_shards.py; while
+            # HISTORY_SHARD_PREVIOUS_RING is set, the bot reads a user from here only once
+            # the row exists.
+            """
+            CREATE TABLE IF NOT EXISTS chat_history_moves (
+                user_id TEXT PRIMARY KEY,
+                source_shard TEXT NOT NULL,
+                copied_through_id INTEGER NOT NULL,
+                moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """,
+        ],
+        True,
+    ),
+]
+
+LATEST_SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    """Returns the highest applied migration version (0 for a fresh database)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations')")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cur.fetchone()[0]
+
+
+def _acquire_migration_lock(conn, logger_param):
+    # Poll with pg_try_advisory_lock rather than blocking in pg_advisory_lock: a session
+    # blocked inside a statement holds a snapshot, and CREATE INDEX CONCURRENTLY in the
+    # session that owns the lock would wait on it.
+    announced = False
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            if cur.fetchone()[0]:
+                return
+        if not announced:
+            logger_param.info("Waiting for another process to finish schema migrations...")
+            announced = True
+        time.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+def apply_migrations(conn, logger_param, target_version: int = None) -> int:
+    """
+    Applies pending migrations in order on the given connection and returns the
+    resulting schema version. The connection is left in its original autocommit mode.
+    """
+    target_version = LATEST_SCHEMA_VERSION if target_version is None else target_version
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        _acquire_migration_lock(conn, logger_param)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                """)
+            current_version = get_schema_version(conn)
+
+            for version, description, statements, transactional in SCHEMA_MIGRATIONS:
+                if version <= current_version or version > target_version:
+                    continue
+                logger_param.info(f"Applying schema migration {version}: {description}")
+                conn.autocommit = not transactional
+                try:
+                    with conn.cursor() as cur:
+                        for statement in statements:
+                            cur.execute(statement)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                    if transactional:
+                        conn.commit()
+                except psycopg2.Error:
+                    if transactional:
+                        conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+                current_version = version
+            return current_version
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.autocommit = previous_autocommit
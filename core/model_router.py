@@ -0,0 +1,307 @@
+# gemini_multichat_bot/core/model_router.py
+
+import asyncio
+import threading
+import time
+
+from core import metrics
+from core.resilience import is_upstream_failure
+
+FAST = "fast"
+STRONG = "strong"
+TIERS = (FAST, STRONG)
+
+# Weight of the newest sample in the smoothed latency and error rate
+ROUTER_SMOOTHING = 0.2
+# How much a backend's recent error rate inflates its score (1.0 error rate -> 5x)
+ERROR_PENALTY = 4.0
+# Score of a backend whose circuit breaker is open: only tried when nothing else is left
+OPEN_CIRCUIT_SCORE = 1e6
+
+backend_duration = metrics.registry.histogram(
+    "gemini_backend_duration_seconds",
+    "Time to a complete response (to the first chunk when streaming) per model backend.",
+    ("backend", "outcome"),
+)
+
+
+def parse_backend_specs(value: str, default_rpm: float) -> list:
+    """
+    Parses GEMINI_BACKENDS, a comma-separated list of tier:model[:api_key_env[:rpm]], e.g.
+    "fast:gemini-1.5-flash-8b:GEMINI_API_KEY,fast:gemini-1.5-flash-8b:GEMINI_API_KEY_2,
+    strong:gemini-1.5-pro". The key is read from the named environment variable
+    (default GEMINI_API_KEY); rpm overrides GEMINI_RATE_LIMIT_RPM for that backend.
+    """
+    specs = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        fields = entry.split(":")
+        if len(fields) < 2 or fields[0] not in TIERS:
+            raise ValueError(f"Invalid GEMINI_BACKENDS entry '{entry}'; expected tier:model[:api_key_env[:rpm]] with tier in {TIERS}.")
+        key_env = fields[2] if len(fields) > 2 and fields[2] else "GEMINI_API_KEY"
+        rpm = float(fields[3]) if len(fields) > 3 and fields[3] else default_rpm
+        specs.append({"tier": fields[0], "model_name": fields[1], "key_env": key_env, "rpm": rpm,
+                      "name": f"{fields[1]}/{key_env}"})
+    return specs
+
+
+def _message_text(contents) -> str:
+    """Text of the newest message in a generate_content() `contents` argument."""
+    if isinstance(contents, str):
+        return contents
+    if not contents:
+        return ""
+    last = contents[-1]
+    if isinstance(last, str):
+        return last
+    return "\n".join(str(part) for part in last.get("parts", []))
+
+
+class ModelBackend:
+    """
+    One model/API key pair, wrapped in its own GuardedModel so each key has its own rate
+    limiter (quota) and circuit breaker, plus the smoothed latency and error rate the
+    router scores it by.
+    """
+
+    def __init__(self, name: str, tier: str, model, weight: float = 1.0):
+        self.name = name
+        self.tier = tier
+        self.model = model
+        self.weight = weight
+        self._lock = threading.Lock()
+        self.latency = None # Smoothed seconds; None until the first success
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self._calls = 0
+        self._failures = 0
+        self._prompt_tokens = 0
+        self._output_tokens = 0
+
+    def score(self) -> float:
+        """Lower is better: expected wait for a rate limit token plus latency, scaled by load and errors."""
+        breaker = getattr(self.model, "breaker", None)
+        if breaker is not None and not breaker.accepting():
+            return OPEN_CIRCUIT_SCORE
+        limiter = getattr(self.model, "limiter", None)
+        quota_wait = limiter.wait_time() if limiter is not None else 0.0
+        with self._lock:
+            latency = self.latency or 0.0 # Untried backends look fast, so they get explored
+            load = 1 + self.in_flight
+            error_rate = self.error_rate
+        return (quota_wait + latency * load) * (1 + ERROR_PENALTY * error_rate) / self.weight
+
+    def begin(self):
+        with self._lock:
+            self._calls += 1
+            self.in_flight += 1
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self.latency = seconds if self.latency is None else (
+                (1 - ROUTER_SMOOTHING) * self.latency + ROUTER_SMOOTHING * seconds
+            )
+        backend_duration.observe(seconds, backend=self.name, outcome="ok")
+
+    def end(self, started: float, error: BaseException = None, response=None):
+        """Finishes a call begun with begin(); records latency only for successful calls."""
+        with self._lock:
+            self.in_flight -= 1
+            if error is None:
+                self.error_rate *= 1 - ROUTER_SMOOTHING
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    self._prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+                    self._output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+            elif is_upstream_failure(error):
+                self._failures += 1
+                self.error_rate = (1 - ROUTER_SMOOTHING) * self.error_rate + ROUTER_SMOOTHING
+        if error is not None:
+            outcome = "cancelled" if isinstance(error, asyncio.CancelledError) else "error"
+            backend_duration.observe(time.perf_counter() - started, backend=self.name, outcome=outcome)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "tier": self.tier,
+                "calls": self._calls,
+                "failures": self._failures,
+                "in_flight": self.in_flight,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "error_rate": round(self.error_rate, 4),
+                "prompt_tokens": self._prompt_tokens,
+                "output_tokens": self._output_tokens,
+            }
+        if hasattr(self.model, "stats"):
+            stats["resilience"] = self.model.stats()
+        return stats
+
+
+class ModelRouter:
+    """
+    Spreads generate_content / generate_content_async calls over several ModelBackends,
+    with the same interface as a single model.
+
+    Each message is classified into a tier: short messages without code go to the
+    `fast` (cheap) backends, everything else to the `strong` ones; callers can force a
+    tier with tier=... . Within the tier the backend with the lowest score is used
+    (see ModelBackend.score): keys close to their quota, slow, busy or failing backends
+    lose traffic to the others. If a call fails with an upstream error (after that
+    backend's own retries), the next best backend is tried, then the other tier, up to
+    max_backend_attempts backends. Other errors are raised right away.
+    """
+
+    def __init__(self, backends: list, short_message_chars: int = 280, max_backend_attempts: int = 2):
+        if not backends:
+            raise ValueError("ModelRouter needs at least one backend.")
+        self.backends = list(backends)
+        self.short_message_chars = short_message_chars
+        self.max_backend_attempts = max(1, max_backend_attempts)
+        self._lock = threading.Lock()
+        self._routed = {tier: 0 for tier in TIERS}
+        self._failovers = 0
+
+    @property
+    def model_name(self):
+        return ",".join(backend.name for backend in self.backends)
+
+    @property
+    def circuit_state(self) -> str:
+        """"closed" while any backend accepts calls, else the state of the first backend."""
+        states = [backend.model.breaker.state for backend in self.backends if hasattr(backend.model, "breaker")]
+        if not states:
+            return "closed"
+        if any(backend.model.breaker.accepting() for backend in self.backends if hasattr(backend.model, "breaker")):
+            return "closed"
+        return states[0]
+
+    def classify(self, contents) -> str:
+        text = _message_text(contents)
+        if len(text) <= self.short_message_chars and "```" not in text:
+            return FAST
+        return STRONG
+
+    def _candidates(self, tier: str) -> list:
+        """Backends of the tier by score, then the other tiers' as fallbacks, open circuits last."""
+        scored = []
+        for index, backend in enumerate(self.backends):
+            score = backend.score()
+            scored.append((score >= OPEN_CIRCUIT_SCORE, backend.tier != tier, score, index, backend))
+        scored.sort(key=lambda item: item[:4])
+        return [item[4] for item in scored[:self.max_backend_attempts]]
+
+    def _route(self, contents, tier: str):
+        tier = tier or self.classify(contents)
+        with self._lock:
+            self._routed[tier] += 1
+        return self._candidates(tier)
+
+    def _failed_over(self):
+        with self._lock:
+            self._failovers += 1
+
+    def generate_content(self, contents, tier: str = None, **kwargs):
+        last_error = None
+        for attempt, backend in enumerate(self._route(contents, tier)):
+            if attempt:
+                self._failed_over()
+            started = time.perf_counter()
+            backend.begin()
+            try:
+                response = backend.model.generate_content(contents, **kwargs)
+            except Exception as e:
+                backend.end(started, e)
+                if not is_upstream_failure(e):
+                    raise
+                last_error = e
+                continue
+            if kwargs.get("stream"):
+                return _RoutedStream(response, backend, started)
+            backend.record_latency(time.perf_counter() - started)
+            backend.end(started, response=response)
+            return response
+        raise last_error
+
+    async def generate_content_async(self, contents, tier: str = None, **kwargs):
+        last_error = None
+        for attempt, backend in enumerate(self._route(contents, tier)):
+            if attempt:
+                self._failed_over()
+            started = time.perf_counter()
+            backend.begin()
+            try:
+                response = await backend.model.generate_content_async(contents, **kwargs)
+            except asyncio.CancelledError as e:
+                backend.end(started, e)
+                raise
+            except Exception as e:
+                backend.end(started, e)
+                if not is_upstream_failure(e):
+                    raise
+                last_error = e
+                continue
+            if kwargs.get("stream"):
+                return _RoutedStream(response, backend, started)
+            backend.record_latency(time.perf_counter() - started)
+            backend.end(started, response=response)
+            return response
+        raise last_error
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"routed": dict(self._routed), "failovers": self._failovers}
+        stats["backends"] = {backend.name: backend.stats() for backend in self.backends}
+        return stats
+
+
+class _RoutedStream:
+    """Streaming response that reports time to first chunk and the outcome to its backend."""
+
+    def __init__(self, response, backend: ModelBackend, started: float):
+        self._response = response
+        self._backend = backend
+        self._started = started
+        self._ended = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _end(self, error: Exception = None):
+        if not self._ended:
+            self._ended = True
+            self._backend.end(self._started, error, None if error else self._response)
+
+    def _first_chunk(self):
+        self._backend.record_latency(time.perf_counter() - self._started)
+
+    def __iter__(self):
+        error = None
+        first = True
+        try:
+            for chunk in self._response:
+                if first:
+                    self._first_chunk()
+                    first = False
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._end(error) # Also runs if the consumer stops early
+
+    async def __aiter__(self):
+        error = None
+        first = True
+        try:
+            async for chunk in self._response:
+                if first:
+                    self._first_chunk()
+                    first = False
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._end(error)
@@ -0,0 +1,380 @@
+# gemini_multichat_bot/core/resilience.py
+
+import asyncio
+import random
+import threading
+import time
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    _RETRYABLE_GOOGLE_ERRORS = (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+    )
+except ImportError: # google-api-core comes with google-generativeai; keep this module importable without it
+    _RETRYABLE_GOOGLE_ERRORS = ()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no rate limiter token became available within the allowed wait."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for quota, overload, 5xx and timeout errors; False for e.g. invalid requests."""
+    if isinstance(error, (CircuitOpenError, RateLimitExceeded)):
+        return False
+    if _RETRYABLE_GOOGLE_ERRORS and isinstance(error, _RETRYABLE_GOOGLE_ERRORS):
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, "retryable", False)
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """True if the error means the model service is unhealthy or we are being throttled."""
+    return isinstance(error, (CircuitOpenError, RateLimitExceeded)) or is_retryable(error)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for the given (1-based) retry attempt."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`.
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._throttled = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+
+    def _reserve(self, max_wait: float):
+        """Takes a token now or reserves one in the future. Returns the wait, or None if too long."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                self._rejected += 1
+                return None
+            self._tokens -= 1 # May go negative: the token is borrowed from the next refill
+            self._acquired += 1
+            if wait > 0:
+                self._throttled += 1
+                self._wait_total += wait
+            return wait
+
+    def wait_time(self) -> float:
+        """Seconds until a token would be available, without taking one (0 when unlimited)."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def acquire(self, max_wait: float):
+        if self.rate <= 0:
+            return
+        wait = self._reserve(max_wait)
+        if wait is None:
+            raise RateLimitExceeded(f"Gemini rate limit reached ({self.rate * 60:.0f} requests/minute).")
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait: float):
+        if self.rate <= 0:
+            return
+        wait = self._reserve(max_wait)
+        if wait is None:
+            raise RateLimitExceeded(f"Gemini rate limit reached ({self.rate * 60:.0f} requests/minute).")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_minute": self.rate * 60,
+                "acquired": self._acquired,
+                "throttled": self._throttled,
+                "rejected": self._rejected,
+                "wait_total_seconds": round(self._wait_total, 6),
+            }
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+
+    After failure_threshold consecutive upstream failures the breaker opens and calls
+    fail fast for recovery_timeout seconds. Then a single trial call is let through
+    (half-open): success closes the breaker, failure opens it again. Successes of calls
+    that started before the breaker opened are ignored while it is open, so only the
+    trial can close it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._transitions = {self.CLOSED: 0, self.OPEN: 0, self.HALF_OPEN: 0}
+        self._rejected = 0
+        self._successes = 0
+        self._failures = 0
+
+    def _set_state(self, state: str):
+        if state != self._state:
+            self._state = state
+            self._transitions[state] += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def accepting(self) -> bool:
+        """Like allow() but without side effects: would a call be let through right now?"""
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.recovery_timeout
+            return self._state == self.CLOSED or not self._trial_in_flight
+
+    def allow(self) -> bool:
+        """Returns True if a call may proceed now."""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self._set_state(self.HALF_OPEN)
+                self._trial_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._state == self.OPEN:
+                return # A call from before the breaker opened; wait for the half-open trial
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def record_neutral(self):
+        """Ends a half-open trial whose outcome says nothing about upstream health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "successes": self._successes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "opened": self._transitions[self.OPEN],
+                "half_opened": self._transitions[self.HALF_OPEN],
+                "closed": self._transitions[self.CLOSED],
+            }
+
+
+class GuardedModel:
+    """
+    Wraps a GenerativeModel (or a fake with the same interface) with a rate limiter,
+    retries with jittered exponential backoff for retryable errors only, and a circuit
+    breaker. generate_content / generate_content_async keep the model's signatures.
+
+    For streaming calls only starting the stream is retried; an error after chunks
+    have been delivered is reported to the breaker and re-raised.
+
+    The breaker counts logical calls, not attempts: a call that is retried and finally
+    gives up is one failure. A half-open trial call is not retried, its first failure
+    reopens the breaker.
+    """
+
+    def __init__(self, model, limiter: TokenBucket, breaker: CircuitBreaker, max_attempts: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0, max_rate_limit_wait: float = 5.0):
+        self.model = model
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._retries = 0
+        self._gave_up = 0
+
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", None)
+
+    def _before_call(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Gemini is currently unavailable (circuit breaker open).")
+
+    def _after_error(self, error: Exception, attempt: int) -> bool:
+        """Returns True if the call should be retried; otherwise records its outcome."""
+        if not is_retryable(error):
+            self.breaker.record_neutral()
+            return False
+        if attempt < self.max_attempts and self.breaker.state == CircuitBreaker.CLOSED:
+            with self._lock:
+                self._retries += 1
+            return True
+        self.breaker.record_failure()
+        with self._lock:
+            self._gave_up += 1
+        return False
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self._calls += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_call()
+            try:
+                self.limiter.acquire(self.max_rate_limit_wait)
+            except RateLimitExceeded:
+                self.breaker.record_neutral()
+                raise
+            try:
+                response = self.model.generate_content(contents, **kwargs)
+            except Exception as e:
+                if not self._after_error(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            if kwargs.get("stream"):
+                return _GuardedStream(response, self.breaker)
+            self.breaker.record_success()
+            return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        with self._lock:
+            self._calls += 1
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_call()
+            try:
+                await self.limiter.acquire_async(self.max_rate_limit_wait)
+            except (RateLimitExceeded, asyncio.CancelledError):
+                self.breaker.record_neutral()
+                raise
+            try:
+                response = await self.model.generate_content_async(contents, **kwargs)
+            except asyncio.CancelledError:
+                # E.g. the reply deadline passed; says nothing about the upstream's health,
+                # but must not leave a half-open trial call marked as in flight
+                self.breaker.record_neutral()
+                raise
+            except Exception as e:
+                if not self._after_error(e, attempt):
+                    raise
+                try:
+                    await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                except asyncio.CancelledError:
+                    self.breaker.record_neutral()
+                    raise
+                continue
+            if kwargs.get("stream"):
+                return _GuardedStream(response, self.breaker)
+            self.breaker.record_success()
+            return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = {"calls": self._calls, "retries": self._retries, "gave_up": self._gave_up}
+        return {"calls": calls, "breaker": self.breaker.stats(), "rate_limiter": self.limiter.stats()}
+
+
+class _GuardedStream:
+    """Wrapper over a streaming response that reports the stream's outcome to the breaker."""
+
+    def __init__(self, response, breaker: CircuitBreaker):
+        self._response = response
+        self._breaker = breaker
+        self._recorded = False
+
+    def __getattr__(self, name):
+        # e.g. usage_metadata / text on the aggregated response once the stream is done
+        return getattr(self._response, name)
+
+    def _record_error(self, error: Exception):
+        self._recorded = True
+        if is_retryable(error):
+            self._breaker.record_failure()
+        else:
+            self._breaker.record_neutral()
+
+    def _record_end(self):
+        # Runs on completion and when the consumer abandons the stream or is cancelled
+        # (GeneratorExit / CancelledError), so a half-open trial never stays in flight
+        if not self._recorded:
+            self._recorded = True
+            self._breaker.record_neutral()
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                yield chunk
+            self._recorded = True
+            self._breaker.record_success()
+        except Exception as e:
+            self._record_error(e)
+            raise
+        finally:
+            self._record_end()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._response:
+                yield chunk
+            self._recorded = True
+            self._breaker.record_success()
+        except Exception as e:
+            self._record_error(e)
+            raise
+        finally:
+            self._record_end()
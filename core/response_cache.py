@@ -0,0 +1,303 @@
+# gemini_multichat_bot/core/response_cache.py
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+# Rough per-entry bookkeeping cost (key string, entry object, dict slot) on top of the text
+_ENTRY_OVERHEAD_BYTES = 200
+# The SQLite tier deletes expired rows once every this many writes
+_SQLITE_PRUNE_EVERY = 500
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?]+$")
+
+
+class ResponseCacheError(Exception):
+    """Raised by a shared response store when the underlying storage fails."""
+
+
+def normalize_message(text: str) -> str:
+    """Case, surrounding whitespace and trailing .!? do not change the answer: "Hi!" == "hi"."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", text.strip().casefold()))
+
+
+def response_cache_key(message: str, history: list, model_name: str, generation_config: dict,
+                       system_instruction: str = "") -> str:
+    """SHA-256 over everything that decides the reply: message, history window, model and config."""
+    payload = json.dumps(
+        [normalize_message(message), history, model_name, generation_config, system_instruction],
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SharedResponseStore:
+    """Second cache tier shared by every process; entries expire after their TTL."""
+
+    name = "base"
+
+    def get(self, key: str):
+        """Returns the cached reply text, or None if missing or expired."""
+        raise NotImplementedError
+
+    def put(self, key: str, text: str, ttl_seconds: float):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PostgresResponseStore(SharedResponseStore):
+    """
+    The response_cache table (core/migrations.py). `connection` is a callable returning
+    a context manager that yields a pooled connection or None, like core.main.db_connection.
+    Expired rows are deleted by the retention job.
+    """
+
+    name = "postgres"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get(self, key: str):
+        try:
+            with self.connection() as conn:
+                if not conn:
+                    raise ResponseCacheError("No database connection available.")
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT response FROM response_cache WHERE cache_key = %s AND expires_at > LOCALTIMESTAMP",
+                        (key,)
+                    )
+                    row = cur.fetchone()
+                conn.rollback()
+        except psycopg2.Error as e:
+            raise ResponseCacheError(str(e)) from e
+        return row[0] if row else None
+
+    def put(self, key: str, text: str, ttl_seconds: float):
+        try:
+            with self.connection() as conn:
+                if not conn:
+                    raise ResponseCacheError("No database connection available.")
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            INSERT INTO response_cache (cache_key, response, expires_at)
+                            VALUES (%s, %s, LOCALTIMESTAMP + %s * INTERVAL '1 second')
+                            ON CONFLICT (cache_key) DO UPDATE
+                            SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+                            """,
+                            (key, text, ttl_seconds)
+                        )
+                    conn.commit()
+                except psycopg2.Error:
+                    conn.rollback()
+                    raise
+        except psycopg2.Error as e:
+            raise ResponseCacheError(str(e)) from e
+
+
+class SQLiteResponseStore(SharedResponseStore):
+    """Response cache in a local WAL-mode SQLite file, shared by the processes on one node."""
+
+    name = "sqlite"
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache (expires_at)",
+    )
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Losing the last few entries on power failure is harmless
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        try:
+            row = self._conn().execute(
+                "SELECT response FROM response_cache WHERE cache_key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise ResponseCacheError(str(e)) from e
+        return row[0] if row else None
+
+    def put(self, key: str, text: str, ttl_seconds: float):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (cache_key, response, expires_at) VALUES (?, ?, ?)",
+                (key, text, now + ttl_seconds)
+            )
+            self._writes += 1 # Approximate across threads; only paces the pruning below
+            if self._writes % _SQLITE_PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            raise ResponseCacheError(str(e)) from e
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _Entry:
+    __slots__ = ("text", "size", "expires_at")
+
+    def __init__(self, key: str, text: str, expires_at: float):
+        self.text = text
+        self.size = _ENTRY_OVERHEAD_BYTES + sys.getsizeof(key) + sys.getsizeof(text)
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Exact-match cache of model replies, keyed by response_cache_key().
+
+    The local tier is a thread-safe LRU bounded by max_entries and max_bytes whose
+    entries expire after ttl_seconds. An optional shared tier (SharedResponseStore) is
+    consulted on a local miss, and its hits are copied into the local tier. Failures of
+    the shared tier are counted and otherwise ignored: the caller just generates a reply.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, shared: SharedResponseStore = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        self._hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._shared_errors = 0
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry.text
+
+    def get(self, key: str):
+        """Returns the cached reply for key, or None on a miss. May query the shared tier."""
+        text = self._get_local(key)
+        if text is not None:
+            return text
+        if self.shared is not None:
+            try:
+                text = self.shared.get(key)
+            except ResponseCacheError:
+                with self._lock:
+                    self._shared_errors += 1
+            if text is not None:
+                with self._lock:
+                    self._shared_hits += 1
+                    self._store(key, text)
+                return text
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, text: str):
+        """Caches a reply in the local tier and, if configured, the shared tier."""
+        with self._lock:
+            self._stores += 1
+            self._store(key, text)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, text, self.ttl_seconds)
+            except ResponseCacheError:
+                with self._lock:
+                    self._shared_errors += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+    def _store(self, key: str, text: str):
+        if key in self._entries:
+            self._remove(key)
+        entry = _Entry(key, text, time.monotonic() + self.ttl_seconds)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._hits + self._shared_hits
+            lookups = hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "shared_hits": self._shared_hits,
+                "misses": self._misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "shared_errors": self._shared_errors,
+            }
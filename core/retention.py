@@ -0,0 +1,355 @@
+# gemini_multichat_bot/core/retention.py
+#
+# Keeps chat_history (and the webhook dedup and response cache tables) from growing without bound. Reads
+# only ever touch the newest MAX_HISTORY_MESSAGES rows per user, so older rows are
+# deleted in small batches, each its own short transaction, so autovacuum can reuse
+# the space and no long lock is ever held:
+#
+#     python -m core.retention                       # one pass with the configured policy
+#     python -m core.retention --max-age-days 90 --vacuum
+#
+# The Telegram bot also runs a pass every RETENTION_INTERVAL_SECONDS on its JobQueue.
+# With HISTORY_SHARDS set, each shard is pruned in turn after DATABASE_URL.
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+from core import main as core_logic
+from core import metrics
+
+logger = logging.getLogger("core_retention")
+
+# Rows kept per user, newest first (0 disables the cap). Never below MAX_HISTORY_MESSAGES.
+RETENTION_MAX_ROWS_PER_USER = int(os.getenv("RETENTION_MAX_ROWS_PER_USER", "200"))
+RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "0")) # 0 keeps rows forever
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.05"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")) # 0: not scheduled
+
+# Arbitrary constant for pg_try_advisory_lock, so that several workers scheduling the
+# job do not delete the same rows concurrently; a pass that cannot get it is skipped.
+RETENTION_LOCK_KEY = 7_316_452_002
+
+SIZE_TABLES = ("chat_history", "chat_summaries", "processed_messages", "response_cache")
+
+_stats_lock = threading.Lock()
+_stats = {
+    "runs": 0,
+    "skipped_runs": 0,
+    "failed_runs": 0,
+    "rows_removed_total": 0,
+    "last_run_rows_removed": 0,
+    "last_run_seconds": 0.0,
+    "table_bytes": {},
+    "index_bytes": {},
+}
+
+
+def _delete_in_batches(conn, statement: str, params: tuple, batch_size: int, pause: float) -> int:
+    """Repeats a `DELETE ... WHERE key IN (SELECT ... LIMIT %s)` until a batch comes up short."""
+    removed = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(statement, params + (batch_size,))
+            deleted = cur.rowcount
+        conn.commit()
+        removed += deleted
+        if deleted < batch_size:
+            return removed
+        if pause:
+            time.sleep(pause)
+
+
+def _users_over_cap(conn, max_rows_per_user: int, batch_size: int):
+    """
+    Yields the users with more than max_rows_per_user rows. Users are walked in user_id
+    order, batch_size at a time, by a loose index scan on idx_chat_history_user_recent
+    (one index probe per user instead of counting the whole table on every pass); each
+    user's check stops at the first row past the cap.
+    """
+    last_user_id = ""
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                WITH RECURSIVE users AS (
+                    (SELECT user_id FROM chat_history WHERE user_id > %s ORDER BY user_id LIMIT 1)
+                    UNION ALL
+                    SELECT (SELECT h.user_id FROM chat_history h
+                            WHERE h.user_id > users.user_id ORDER BY h.user_id LIMIT 1)
+                    FROM users WHERE users.user_id IS NOT NULL
+                )
+                SELECT user_id, EXISTS (
+                    SELECT 1 FROM chat_history h WHERE h.user_id = users.user_id
+                    ORDER BY h.timestamp DESC, h.id DESC OFFSET %s LIMIT 1
+                )
+                FROM users WHERE user_id IS NOT NULL
+                LIMIT %s
+                """,
+                (last_user_id, max_rows_per_user, batch_size)
+            )
+            page = cur.fetchall()
+        conn.commit()
+        for user_id, over_cap in page:
+            if over_cap:
+                yield user_id
+        if len(page) < batch_size:
+            return
+        last_user_id = page[-1][0]
+
+
+def table_sizes(conn) -> dict:
+    """Returns {table: (table_bytes, index_bytes)}; table bytes include TOAST."""
+    sizes = {}
+    with conn.cursor() as cur:
+        for table in SIZE_TABLES:
+            cur.execute("SELECT to_regclass(%s)", (table,))
+            if cur.fetchone()[0] is None:
+                continue
+            cur.execute("SELECT pg_table_size(%s), pg_indexes_size(%s)", (table, table))
+            sizes[table] = cur.fetchone()
+    conn.rollback()
+    return sizes
+
+
+def prune(conn, logger_param, max_rows_per_user: int = RETENTION_MAX_ROWS_PER_USER,
+          max_age_days: float = RETENTION_MAX_AGE_DAYS, dedup_ttl_seconds: float = None,
+          batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_BATCH_PAUSE_SECONDS):
+    """
+    Runs one retention pass on `conn` and returns a report dict, or None if another
+    process holds the retention lock. Each batch is committed on its own.
+    """
+    if dedup_ttl_seconds is None:
+        dedup_ttl_seconds = core_logic.MESSAGE_DEDUP_TTL_SECONDS
+    if max_rows_per_user and max_rows_per_user < core_logic.MAX_HISTORY_MESSAGES:
+        logger_param.warning(
+            f"Retention cap of {max_rows_per_user} rows per user is below MAX_HISTORY_MESSAGES; "
+            f"keeping {core_logic.MAX_HISTORY_MESSAGES}."
+        )
+        max_rows_per_user = core_logic.MAX_HISTORY_MESSAGES
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (RETENTION_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        return None
+
+    started = time.monotonic()
+    report = {"capped_rows": 0, "expired_rows": 0, "expired_summaries": 0, "processed_messages": 0,
+              "cached_responses": 0}
+    try:
+        if max_rows_per_user:
+            for user_id in _users_over_cap(conn, max_rows_per_user, batch_size):
+                report["capped_rows"] += _delete_in_batches(
+                    conn,
+                    """
+                    DELETE FROM chat_history WHERE id IN (
+                        SELECT id FROM chat_history
+                        WHERE user_id = %s
+                        ORDER BY timestamp DESC, id DESC
+                        OFFSET %s LIMIT %s
+                    )
+                    """,
+                    (user_id, max_rows_per_user), batch_size, pause,
+                )
+
+        if max_age_days:
+            max_age_seconds = max_age_days * 86400
+            report["expired_rows"] = _delete_in_batches(
+                conn,
+                """
+                DELETE FROM chat_history WHERE id IN (
+                    SELECT id FROM chat_history
+                    WHERE timestamp < LOCALTIMESTAMP - %s * INTERVAL '1 second'
+                    LIMIT %s
+                )
+                """,
+                (max_age_seconds,), batch_size, pause,
+            )
+            # A summary not updated within the TTL only describes messages that are gone
+            report["expired_summaries"] = _delete_in_batches(
+                conn,
+                """
+                DELETE FROM chat_summaries WHERE user_id IN (
+                    SELECT user_id FROM chat_summaries
+                    WHERE updated_at < LOCALTIMESTAMP - %s * INTERVAL '1 second'
+                    LIMIT %s
+                )
+                """,
+                (max_age_seconds,), batch_size, pause,
+            )
+
+        if dedup_ttl_seconds:
+            # Redeliveries older than the dedup window are no longer expected
+            report["processed_messages"] = _delete_in_batches(
+                conn,
+                """
+                DELETE FROM processed_messages WHERE message_id IN (
+                    SELECT message_id FROM processed_messages
+                    WHERE created_at < LOCALTIMESTAMP - %s * INTERVAL '1 second'
+                    LIMIT %s
+                )
+                """,
+                (dedup_ttl_seconds,), batch_size, pause,
+            )
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('response_cache')")
+            has_response_cache = cur.fetchone()[0] is not None
+        conn.commit()
+        if has_response_cache: # Expired shared response cache entries are never read again
+            report["cached_responses"] = _delete_in_batches(
+                conn,
+                """
+                DELETE FROM response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM response_cache
+                    WHERE expires_at <= LOCALTIMESTAMP
+                    LIMIT %s
+                )
+                """,
+                (), batch_size, pause,
+            )
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_KEY,))
+        conn.commit()
+
+    report["rows_removed"] = sum(report.values())
+    report["seconds"] = round(time.monotonic() - started, 3)
+    report["sizes"] = table_sizes(conn)
+    return report
+
+
+def vacuum(conn, tables: tuple = SIZE_TABLES):
+    """VACUUM (ANALYZE) the given tables; needs autocommit, restored afterwards."""
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for table in tables:
+                cur.execute("SELECT to_regclass(%s)", (table,))
+                if cur.fetchone()[0] is not None:
+                    cur.execute(f"VACUUM (ANALYZE) {table}")
+    finally:
+        conn.autocommit = previous_autocommit
+
+
+def _record_report(label: str, report: dict):
+    # Sizes of the shards are reported as <shard>_<table> next to the main database's
+    prefix = "" if label == "main" else f"{label}_"
+    with _stats_lock:
+        if report is None:
+            _stats["skipped_runs"] += 1
+            return
+        _stats["runs"] += 1
+        _stats["rows_removed_total"] += report["rows_removed"]
+        _stats["last_run_rows_removed"] = report["rows_removed"]
+        _stats["last_run_seconds"] = report["seconds"]
+        for table, (table_bytes, index_bytes) in report["sizes"].items():
+            _stats["table_bytes"][prefix + table] = table_bytes
+            _stats["index_bytes"][prefix + table] = index_bytes
+
+
+def format_report(report: dict) -> str:
+    sizes = ", ".join(
+        f"{table} {table_bytes / 1048576:.1f} MiB + {index_bytes / 1048576:.1f} MiB indexes"
+        for table, (table_bytes, index_bytes) in report["sizes"].items()
+    )
+    return (
+        f"Retention removed {report['rows_removed']} rows in {report['seconds']}s "
+        f"(per-user cap {report['capped_rows']}, expired {report['expired_rows']}, "
+        f"summaries {report['expired_summaries']}, processed messages {report['processed_messages']}, "
+        f"cached responses {report['cached_responses']}). "
+        f"Sizes: {sizes or 'n/a'}"
+    )
+
+
+def _run_retention_on(label: str, connection, logger_param, **policy):
+    try:
+        with connection() as conn:
+            if not conn:
+                return None
+            report = prune(conn, logger_param, **policy)
+    except psycopg2.Error as e:
+        logger_param.error(f"History retention failed on {label}: {e}")
+        with _stats_lock:
+            _stats["failed_runs"] += 1
+        return None
+    _record_report(label, report)
+    if report is None:
+        logger_param.info(f"History retention on {label} is already running elsewhere; skipped this pass.")
+    else:
+        logger_param.info(f"{label}: {format_report(report)}")
+    return report
+
+
+def run_retention(logger_param=logger, **policy) -> dict:
+    """
+    Runs one pass on DATABASE_URL and each history shard, logs and records the results.
+    Returns {label: report}, with None for databases that failed or were skipped. Never raises.
+    """
+    return {
+        label: _run_retention_on(label, connection, logger_param, **policy)
+        for label, connection in core_logic.database_connections(logger_param)
+    }
+
+
+def get_retention_stats() -> dict:
+    """Returns retention run counters and the table/index sizes seen by the last pass."""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["table_bytes"] = dict(stats["table_bytes"])
+        stats["index_bytes"] = dict(stats["index_bytes"])
+    return stats
+
+metrics.registry.register_stats("chatbot_retention", get_retention_stats)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Delete old chat history in small batches.")
+    parser.add_argument("--max-rows-per-user", type=int, default=RETENTION_MAX_ROWS_PER_USER,
+                        help=f"Newest rows kept per user, 0 for no cap (default: {RETENTION_MAX_ROWS_PER_USER}).")
+    parser.add_argument("--max-age-days", type=float, default=RETENTION_MAX_AGE_DAYS,
+                        help=f"Delete rows older than this, 0 to keep them (default: {RETENTION_MAX_AGE_DAYS:g}).")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM (ANALYZE) the tables afterwards.")
+    args = parser.parse_args(argv)
+
+    databases = core_logic.database_connections(logger)
+    if not databases:
+        logger.error("Neither DATABASE_URL nor HISTORY_SHARDS is set; nothing to prune.")
+        return 1
+
+    try:
+        reports = run_retention(
+            logger, max_rows_per_user=args.max_rows_per_user,
+            max_age_days=args.max_age_days, batch_size=args.batch_size,
+        )
+        if any(report is None for report in reports.values()):
+            return 1
+        if args.vacuum:
+            for label, connection in databases:
+                with connection() as conn:
+                    if not conn:
+                        return 1
+                    vacuum(conn)
+                    logger.info(f"Sizes of {label} after VACUUM: {table_sizes(conn)}")
+    except psycopg2.Error as e:
+        logger.error(f"VACUUM failed: {e}")
+        return 1
+    finally:
+        core_logic.close_db_pool()
+        core_logic.close_shard_pools()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+# gemini_multichat_bot/core/run.py
+#
+# Runs several platforms in one process so they share one Gemini client, DB pool,
+# history cache, write-behind queue and dispatcher:
+#
+#     python -m core.run --platforms telegram,discord,whatsapp
+#
+# Telegram and the dispatcher run on the main asyncio event loop; the Discord gateway gets
+# a loop of its own (see DISCORD_OFFLOAD_GENERATION) and the WhatsApp Flask app is served
+# by cheroot, a production WSGI server with a bounded worker pool and socket timeouts;
+# both submit their messages to the main loop.
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import threading
+
+from core import main as core_logic
+
+logger = logging.getLogger("core_run")
+
+PLATFORMS = ("telegram", "discord", "whatsapp")
+# Seconds to let in-flight replies finish after the platforms stop taking new messages
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "20"))
+# WSGI worker threads for the WhatsApp webhook. Inline (TwiML) replies hold one for up to
+# WHATSAPP_INLINE_REPLY_DEADLINE seconds; async replies release it right away.
+WHATSAPP_HTTP_THREADS = int(os.getenv("WHATSAPP_HTTP_THREADS", "16"))
+# Seconds a connection may sit idle while reading a request or writing a response
+WHATSAPP_HTTP_SOCKET_TIMEOUT = float(os.getenv("WHATSAPP_HTTP_SOCKET_TIMEOUT", "10"))
+
+
+def parse_platforms(value: str) -> list:
+    platforms = [name.strip().lower() for name in value.split(",") if name.strip()]
+    unknown = [name for name in platforms if name not in PLATFORMS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown platform(s): {', '.join(unknown)}. Choose from {', '.join(PLATFORMS)}.")
+    if not platforms:
+        raise argparse.ArgumentTypeError("No platforms given.")
+    return platforms
+
+
+class _TelegramRunner:
+    name = "telegram"
+
+    def __init__(self):
+        from platforms import telegram_bot
+        self.module = telegram_bot
+        self.application = telegram_bot.build_application()
+
+    async def start(self) -> bool:
+        if self.application is None:
+            return False
+        webhook = None
+        if self.module.use_webhook():
+            webhook = self.module.webhook_options()
+            if webhook is None:
+                return False
+            self.module.prepare_webhook_instance()
+        await self.application.initialize()
+        await self.application.start()
+        if webhook:
+            await self.application.updater.start_webhook(**webhook)
+            logger.info(f"Telegram webhook listening on port {webhook['port']}.")
+        else:
+            await self.application.updater.start_polling()
+        return True
+
+    async def stop_intake(self):
+        if self.application.updater.running:
+            await self.application.updater.stop()
+
+    async def stop(self):
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+
+
+class _DiscordRunner:
+    name = "discord"
+
+    def __init__(self):
+        from platforms import discord_bot
+        self.module = discord_bot
+        self.task = None
+        self.loop = None
+        self.thread = None
+
+    async def start(self) -> bool:
+        if not self.module.DISCORD_BOT_TOKEN:
+            logger.error("DISCORD_BOT_TOKEN not found in environment variables. Discord bot cannot start.")
+            return False
+        if self.module.DISCORD_OFFLOAD_GENERATION:
+            # The gateway gets a loop and thread of its own: generations stay on the shared
+            # dispatcher loop, so they can never delay the shards' heartbeats.
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run_gateway, name="discord-gateway", daemon=True)
+            self.thread.start()
+            return True
+        self.task = asyncio.create_task(self.module.bot.start(self.module.DISCORD_BOT_TOKEN))
+        self.task.add_done_callback(self._on_exit)
+        return True
+
+    def _run_gateway(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.module.bot.start(self.module.DISCORD_BOT_TOKEN))
+        except Exception as e:
+            logger.error(f"Discord bot stopped with an error: {e}")
+        finally:
+            self.loop.close()
+
+    def _on_exit(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Discord bot stopped with an error: {task.exception()}")
+
+    async def stop_intake(self):
+        pass # The gateway connection also carries replies; it is closed in stop()
+
+    async def stop(self):
+        if self.thread is not None:
+            if not self.loop.is_closed():
+                try:
+                    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.module.bot.close(), self.loop))
+                except RuntimeError:
+                    pass # The gateway loop finished on its own in the meantime
+            await asyncio.get_running_loop().run_in_executor(None, self.thread.join, 10)
+            return
+        await self.module.bot.close()
+        if self.task is not None:
+            try:
+                await self.task
+            except Exception:
+                pass # Already logged by _on_exit
+
+
+class _WhatsAppRunner:
+    name = "whatsapp"
+
+    def __init__(self, host: str, port: int):
+        from platforms import whatsapp_bot
+        self.app = whatsapp_bot.app
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    async def start(self) -> bool:
+        from cheroot.wsgi import Server
+        self.server = Server(
+            (self.host, self.port), self.app,
+            numthreads=WHATSAPP_HTTP_THREADS,
+            timeout=WHATSAPP_HTTP_SOCKET_TIMEOUT,
+            shutdown_timeout=SHUTDOWN_GRACE_SECONDS,
+            server_name="multichat-whatsapp",
+        )
+        self.server.prepare() # Binds now, so a taken port fails start() instead of the thread
+        self.thread = threading.Thread(target=self.server.serve, name="whatsapp-http", daemon=True)
+        self.thread.start()
+        logger.info(f"WhatsApp webhook listening on http://{self.host}:{self.port}/whatsapp_webhook")
+        return True
+
+    async def stop_intake(self):
+        # Stops accepting connections and waits (up to shutdown_timeout) for in-flight requests
+        await asyncio.get_running_loop().run_in_executor(None, self.server.stop)
+        self.thread.join(5)
+
+    async def stop(self):
+        pass # Replies go out through the Twilio REST client, nothing else to close
+
+
+async def run_platforms(platforms: list, host: str, port: int):
+    loop = asyncio.get_running_loop()
+    # The WhatsApp webhook threads submit to this loop too, so every platform shares one
+    # dispatcher queue and one concurrency limit.
+    core_logic.dispatcher.bind_loop(loop)
+
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError: # e.g. Windows
+            pass
+
+    runners = []
+    for name in platforms:
+        if name == "telegram":
+            runner = _TelegramRunner()
+        elif name == "discord":
+            runner = _DiscordRunner()
+        else:
+            runner = _WhatsAppRunner(host, port)
+        try:
+            started = await runner.start()
+        except Exception as e:
+            logger.error(f"Could not start {name}: {e}")
+            started = False
+        if started:
+            runners.append(runner)
+            logger.info(f"Started {name}.")
+
+    if not runners:
+        logger.error("No platform could be started.")
+        return
+
+    await stop_event.wait()
+    logger.info("Shutting down...")
+
+    # Stop taking new messages first, let queued replies finish, then close the clients
+    for runner in reversed(runners):
+        try:
+            await runner.stop_intake()
+        except Exception as e:
+            logger.error(f"Error while stopping {runner.name}: {e}")
+    if not await core_logic.dispatcher.wait_idle(SHUTDOWN_GRACE_SECONDS):
+        logger.warning(f"Replies still in flight after {SHUTDOWN_GRACE_SECONDS}s; stopping anyway.")
+    for runner in reversed(runners):
+        try:
+            await runner.stop()
+        except Exception as e:
+            logger.error(f"Error while stopping {runner.name}: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several chat platforms in one process.")
+    parser.add_argument("--platforms", type=parse_platforms, default=os.getenv("RUN_PLATFORMS", ",".join(PLATFORMS)),
+                        help="Comma-separated list of platforms to run (default: all).")
+    parser.add_argument("--host", default=os.getenv("WHATSAPP_HOST", "0.0.0.0"),
+                        help="Interface for the WhatsApp webhook server.")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5002")),
+                        help="Port for the WhatsApp webhook server (default: $PORT or 5002).")
+    args = parser.parse_args(argv)
+    platforms = args.platforms if isinstance(args.platforms, list) else parse_platforms(args.platforms)
+
+    if "telegram" in platforms and "whatsapp" in platforms:
+        from platforms import telegram_bot
+        if telegram_bot.use_webhook() and telegram_bot.TELEGRAM_WEBHOOK_PORT == args.port:
+            parser.error("The Telegram webhook and the WhatsApp webhook need different ports; set TELEGRAM_WEBHOOK_PORT.")
+
+    logger.info(f"Starting platforms: {', '.join(platforms)}")
+    core_logic.init(logger)
+    if "whatsapp" not in platforms:
+        core_logic.start_metrics_server(logger) # Otherwise the WhatsApp app serves /metrics and /healthz
+    try:
+        asyncio.run(run_platforms(platforms, args.host, args.port))
+    finally:
+        core_logic.shutdown_write_behind()
+        core_logic.close_history_store()
+        core_logic.close_response_cache()
+        core_logic.close_db_pool()
+    logger.info("All platforms stopped.")
+
+
+if __name__ == "__main__":
+    main()
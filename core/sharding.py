@@ -0,0 +1,60 @@
+# gemini_multichat_bot/core/sharding.py
+
+import hashlib
+from bisect import bisect_right
+from collections import OrderedDict
+
+# Points per shard on the ring. More points spread users more evenly; the value must be
+# the same in every process (and the rebalance tool), so it is not configurable.
+VIRTUAL_NODES = 512
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys (user ids) onto named shards. Only shard names are
+    hashed, never URLs, so credentials or hosts can change without moving anyone.
+    Adding a shard to N existing ones moves about 1/(N+1) of the keys, all of them to
+    the new shard; removing one moves only that shard's keys.
+    """
+
+    def __init__(self, names, virtual_nodes: int = VIRTUAL_NODES):
+        self.names = list(names)
+        if not self.names:
+            raise ValueError("A hash ring needs at least one shard.")
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f"Duplicate shard names in {self.names}.")
+        points = sorted(
+            (_hash(f"{name}#{index}"), name) for name in self.names for index in range(virtual_nodes)
+        )
+        self._positions = [position for position, _ in points]
+        self._owners = [name for _, name in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect_right(self._positions, _hash(key)) % len(self._positions)
+        return self._owners[index]
+
+
+def parse_shards(value: str) -> OrderedDict:
+    """Parses HISTORY_SHARDS, whitespace-separated name=url pairs, into {name: url}."""
+    shards = OrderedDict()
+    for entry in value.split():
+        name, separator, url = entry.partition("=")
+        if not separator or not name or not url:
+            raise ValueError(f"Invalid HISTORY_SHARDS entry '{entry}'; expected name=postgresql://...")
+        if name in shards:
+            raise ValueError(f"Shard '{name}' is listed twice in HISTORY_SHARDS.")
+        shards[name] = url
+    return shards
+
+
+def parse_ring(value: str, shards: dict) -> list:
+    """Parses a list of shard names (whitespace or comma separated) that must all be in `shards`."""
+    names = [name for name in value.replace(",", " ").split() if name]
+    unknown = [name for name in names if name not in shards]
+    if unknown:
+        raise ValueError(f"Shards {unknown} are not defined in HISTORY_SHARDS.")
+    return names
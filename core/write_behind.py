@@ -0,0 +1,335 @@
+# gemini_multichat_bot/core/write_behind.py
+
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locking of the spill file
+    fcntl = None
+
+# Longest pause between flush attempts while the database is unreachable
+MAX_RETRY_BACKOFF_SECONDS = 30.0
+
+
+class WriteBehindQueue:
+    """
+    Buffers chat history rows and writes them in bulk on a background thread.
+
+    enqueue() returns immediately. A single flusher thread writes rows in the order they
+    were enqueued (which keeps each user's messages in order) whenever batch_size rows
+    are waiting or the oldest row has waited flush_interval seconds.
+
+    write_rows(rows) does the actual bulk insert for a list of (user_id, record,
+    created_at) tuples and must raise on failure. Rows from a failed batch are appended
+    to a JSON-lines spill file (capped at spill_max_bytes) and replayed, oldest first,
+    once the database is reachable again.
+
+    Several processes on a host may share one spill file. Appends take an exclusive lock
+    on `<spill_path>.lock`; a replay first renames the file to `<spill_path>.replay`
+    under that lock, so rows spilled meanwhile go to a fresh file, and only one process
+    replays at a time (`<spill_path>.replay.lock`).
+    """
+
+    def __init__(self, write_rows, logger_param, batch_size: int = 200, flush_interval: float = 0.5,
+                 max_pending: int = 10000, spill_path: str = None, spill_max_bytes: int = 50 * 1024 * 1024):
+        self.write_rows = write_rows
+        self.logger = logger_param
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+
+        self._cond = threading.Condition()
+        self._pending = deque() # (user_id, record, created_at, enqueued_monotonic)
+        self._in_flight = [] # Batch currently being written
+        # Held while a batch commits and its record ids are filled in, so readers can
+        # tell committed rows from ones that are still only in memory.
+        self.commit_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._retry_at = 0.0
+        self._backoff = flush_interval
+        # Set while the spill file holds rows that still need to be replayed
+        self._spill_waiting = bool(spill_path) and (
+            os.path.exists(spill_path) or os.path.exists(spill_path + ".replay")
+        )
+
+        self._enqueued = 0
+        self._written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._spilled = 0
+        self._replayed = 0
+        self._dropped = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="core-write-behind", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, user_id: str, records: list):
+        """Queues records ({"id", "role", "content"}) for user_id; ids are filled in once written."""
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._stopping:
+                # Backpressure: the flusher is far behind, wait for it rather than grow without bound
+                self._cond.wait(self.flush_interval)
+            now = time.monotonic()
+            for record in records:
+                self._pending.append((user_id, record, created_at, now))
+            self._enqueued += len(records)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def pending_for(self, user_id: str) -> list:
+        """Records for user_id that have been acknowledged but not yet written, oldest first."""
+        with self._cond:
+            return [item[1] for item in list(self._in_flight) + list(self._pending) if item[0] == user_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    now = time.monotonic()
+                    if self._pending and now >= self._retry_at:
+                        oldest_age = now - self._pending[0][3]
+                        if len(self._pending) >= self.batch_size or oldest_age >= self.flush_interval:
+                            break
+                        timeout = self.flush_interval - oldest_age
+                    elif self._spill_waiting and now >= self._retry_at:
+                        break # Nothing new to write, but spilled rows from an outage are waiting
+                    elif self._pending or self._spill_waiting:
+                        timeout = self._retry_at - now
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+            self._flush_once()
+
+    def _flush_once(self) -> bool:
+        with self._cond:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._in_flight = batch
+            self._cond.notify_all() # Wake producers blocked on max_pending
+        ok = self._replay_spill() and (not batch or self._write_batch(batch))
+        if not ok and batch:
+            self._spill(batch)
+        with self._cond:
+            self._in_flight = []
+            if ok:
+                self._backoff = self.flush_interval
+                self._retry_at = 0.0
+            else:
+                self._retry_at = time.monotonic() + self._backoff
+                self._backoff = min(self._backoff * 2, MAX_RETRY_BACKOFF_SECONDS)
+        return ok
+
+    def _write_batch(self, batch: list) -> bool:
+        rows = [(user_id, record, created_at) for user_id, record, created_at, _ in batch]
+        try:
+            with self.commit_lock:
+                self.write_rows(rows)
+        except Exception as e:
+            self.logger.error(f"Write-behind flush of {len(rows)} messages failed: {e}")
+            with self._cond:
+                self._failed_flushes += 1
+            return False
+        with self._cond:
+            self._flushes += 1
+            self._written += len(rows)
+        return True
+
+    def _spill(self, batch: list):
+        # A sharded store writes each shard's rows on its own and fills in their ids even
+        # when another shard fails; those rows are saved and must not be written again.
+        batch = [item for item in batch if item[1]["id"] is None]
+        if not batch:
+            return
+        if not self.spill_path:
+            with self._cond:
+                self._dropped += len(batch)
+            self.logger.error(f"Dropped {len(batch)} unsaved messages (no spill file configured).")
+            return
+        lines = "".join(
+            json.dumps({
+                "user_id": user_id,
+                "role": record["role"],
+                "content": record["content"],
+                "created_at": created_at.isoformat(),
+            }) + "\n"
+            for user_id, record, created_at, _ in batch
+        )
+        try:
+            with _file_lock(self.spill_path + ".lock"):
+                current_size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+                if current_size + len(lines.encode("utf-8")) > self.spill_max_bytes:
+                    with self._cond:
+                        self._dropped += len(batch)
+                    self.logger.error(
+                        f"Spill file {self.spill_path} is full ({current_size} bytes); dropped {len(batch)} messages."
+                    )
+                    return
+                with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                    spill_file.write(lines)
+                    spill_file.flush()
+                    os.fsync(spill_file.fileno())
+            with self._cond:
+                self._spilled += len(batch)
+                self._spill_waiting = True
+        except OSError as e:
+            with self._cond:
+                self._dropped += len(batch)
+            self.logger.error(f"Could not write spill file {self.spill_path}: {e}")
+
+    def _replay_spill(self) -> bool:
+        """Writes previously spilled rows first so per-user order is preserved."""
+        replay_path = self.spill_path + ".replay" if self.spill_path else None
+        if not replay_path or not (os.path.exists(self.spill_path) or os.path.exists(replay_path)):
+            with self._cond:
+                self._spill_waiting = False
+            return True
+        with _file_lock(self.spill_path + ".replay.lock", blocking=False) as acquired:
+            if not acquired:
+                return False # Another process is replaying; our own spilled rows may be among them
+            # A leftover .replay file from a failed attempt, then the current spill file.
+            # Rows other processes spill meanwhile wait for the next flush.
+            for _ in range(2):
+                try:
+                    with _file_lock(self.spill_path + ".lock"):
+                        if not os.path.exists(replay_path) and os.path.exists(self.spill_path):
+                            os.replace(self.spill_path, replay_path)
+                except OSError as e:
+                    self.logger.error(f"Could not claim spill file {self.spill_path}: {e}")
+                    return False
+                if not os.path.exists(replay_path):
+                    break
+                if not self._replay_file(replay_path):
+                    return False
+        with self._cond:
+            self._spill_waiting = os.path.exists(self.spill_path)
+        return True
+
+    def _replay_file(self, replay_path: str) -> bool:
+        try:
+            with open(replay_path, "r", encoding="utf-8") as spill_file:
+                entries = [json.loads(line) for line in spill_file if line.strip()]
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not read spill file {replay_path}: {e}")
+            return False
+        rows = [
+            (
+                entry["user_id"],
+                {"id": None, "role": entry["role"], "content": entry["content"]},
+                datetime.datetime.fromisoformat(entry["created_at"]),
+            )
+            for entry in entries
+        ]
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            try:
+                with self.commit_lock:
+                    self.write_rows(chunk)
+            except Exception as e:
+                self.logger.error(f"Replaying spilled messages failed: {e}")
+                # Keep the rows that were not written yet for the next attempt
+                try:
+                    self._rewrite_spill(replay_path, [row for row in rows[start:] if row[1]["id"] is None])
+                except OSError as rewrite_error:
+                    self.logger.error(f"Could not rewrite spill file {replay_path}: {rewrite_error}")
+                return False
+            with self._cond:
+                self._replayed += len(chunk)
+        os.remove(replay_path)
+        self.logger.info(f"Replayed {len(rows)} spilled messages into the database.")
+        return True
+
+    def _rewrite_spill(self, path: str, rows: list):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as spill_file:
+            for user_id, record, created_at in rows:
+                spill_file.write(json.dumps({
+                    "user_id": user_id,
+                    "role": record["role"],
+                    "content": record["content"],
+                    "created_at": created_at.isoformat(),
+                }) + "\n")
+        os.replace(temp_path, path)
+
+    def flush(self):
+        """Synchronously writes everything that is currently pending."""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    return
+            if not self._flush_once():
+                return # The rest stays queued (or spilled) for the next attempt
+
+    def shutdown(self, timeout: float = 10.0):
+        """Stops the flusher thread and drains pending rows (spilling them if the DB is down)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if thread is not None and thread.is_alive():
+            # The flusher is still stuck in a write; flushing from here as well would race
+            # it, so the rest goes straight to the spill file (its batch stays its own).
+            self.logger.warning("Write-behind flusher did not stop in time; spilling pending messages.")
+            deadline = 0.0
+        else:
+            deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._pending:
+                    break
+            if not self._flush_once():
+                break
+        with self._cond:
+            remaining = [self._pending.popleft() for _ in range(len(self._pending))]
+        if remaining:
+            self._spill(remaining)
+
+    def stats(self) -> dict:
+        with self._cond:
+            spill_bytes = 0
+            if self.spill_path and os.path.exists(self.spill_path):
+                spill_bytes = os.path.getsize(self.spill_path)
+            return {
+                "pending": len(self._pending) + len(self._in_flight),
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "spilled": self._spilled,
+                "replayed": self._replayed,
+                "dropped": self._dropped,
+                "spill_file_bytes": spill_bytes,
+            }
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """Exclusive flock on `path` (created if missing); yields whether it was acquired."""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
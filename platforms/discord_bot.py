@@ -1,5 +1,6 @@
 # gemini_multichat_bot/platforms/discord_bot.py
 
+import asyncio
 import discord
 from discord.ext import commands
 import os
@@ -9,12 +10,29 @@ from dotenv import load_dotenv
 # Import core logic
 import re # For parsing due date
 from core import main as core_logic
+from core.dispatcher import DispatcherBusy
+from platforms.streaming import relay_stream, truncate_for_platform
 
 # Load environment variables from .env file (expected in the parent directory)
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+DISCORD_MESSAGE_LIMIT = 2000
+# Discord allows roughly 5 message edits per 5 seconds per channel
+DISCORD_STREAM_EDIT_INTERVAL = float(os.getenv("DISCORD_STREAM_EDIT_INTERVAL", "1.2"))
+
+# Sharding: with DISCORD_SHARDING=auto the bot is an AutoShardedBot. DISCORD_SHARD_COUNT
+# is the total across all processes (0: Discord's recommendation) and DISCORD_SHARD_IDS
+# the ranges this process runs, e.g. "0-7" here and "8-15" in a second process.
+DISCORD_SHARDING = os.getenv("DISCORD_SHARDING", "none").lower()
+DISCORD_SHARD_COUNT = int(os.getenv("DISCORD_SHARD_COUNT", "0"))
+DISCORD_SHARD_IDS = os.getenv("DISCORD_SHARD_IDS", "")
+# Messages kept in the client cache (0 disables it; replies never read old messages)
+DISCORD_MAX_MESSAGES = int(os.getenv("DISCORD_MAX_MESSAGES", "100"))
+# Answer messages on the dispatcher's own event loop, off the gateway loop, so a burst of
+# generations can never delay heartbeats. Replies are posted back through the gateway loop.
+DISCORD_OFFLOAD_GENERATION = os.getenv("DISCORD_OFFLOAD_GENERATION", "true").lower() in ("1", "true", "yes")
 
 # Configure logging
 logger = logging.getLogger('discord') # Using discord's logger
@@ -23,23 +41,61 @@ handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
 logger.addHandler(handler)
 
+def parse_shard_ids(value: str):
+    """Parses "0-3,8,10-11" into [0, 1, 2, 3, 8, 10, 11]; empty means all shards (None)."""
+    shard_ids = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(shard_ids)) or None
+
+
 # Define intents
-# discord.py 2.0+ requires explicit intents.
-# For a basic bot, default intents might be enough, but for reading messages, message_content is needed.
-intents = discord.Intents.default()
+# discord.py 2.0+ requires explicit intents. Only what the bot uses: guild and DM messages
+# with their content, plus guilds for the channel cache. Without the members and presences
+# intents the gateway neither sends nor caches every member of every guild.
+intents = discord.Intents.none()
+intents.guilds = True
+intents.guild_messages = True
+intents.dm_messages = True
 intents.message_content = True  # Crucial for reading message content
-intents.members = True # If you need member information
+
+
+def bot_options() -> dict:
+    """Client cache settings shared by the bot and tools/discord_memory.py."""
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+        "max_messages": DISCORD_MAX_MESSAGES or None,
+    }
+
+
+def create_bot():
+    # Using commands.Bot for command handling
+    # Disable the default help command to use our custom one
+    options = dict(bot_options(), command_prefix="!", help_command=None)
+    if DISCORD_SHARDING != "auto":
+        return commands.Bot(**options)
+    shard_ids = parse_shard_ids(DISCORD_SHARD_IDS)
+    if shard_ids is not None and not DISCORD_SHARD_COUNT:
+        raise ValueError("DISCORD_SHARD_IDS needs DISCORD_SHARD_COUNT (the total number of shards).")
+    return commands.AutoShardedBot(shard_count=DISCORD_SHARD_COUNT or None, shard_ids=shard_ids, **options)
+
 
 # Initialize the bot
-# Using commands.Bot for command handling
-# Disable the default help command to use our custom one
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+bot = create_bot()
 
 @bot.event
 async def on_ready():
     """Event handler for when the bot has successfully connected."""
     logger.info(f'{bot.user.name} has connected to Discord!')
     logger.info(f'User ID: {bot.user.id}')
+    if isinstance(bot, commands.AutoShardedBot):
+        logger.info(f'Running shards {sorted(bot.shards)} of {bot.shard_count}, {len(bot.guilds)} guilds.')
     logger.info('Bot is ready and listening for commands.')
     try:
         # Sync commands if using slash commands (discord.app_commands)
@@ -86,21 +142,51 @@ async def on_message(message):
     # If it's not a command and not from the bot, then process with Gemini chat logic
     user_id = str(message.author.id)
     text = message.content
-    
-    # Pass the platform-specific logger to the core logic
-    response_text = core_logic.generate_chat_response(user_id, text, logger)
-    
-    # Discord messages have a 2000 character limit.
-    if len(response_text) > 2000:
-        await message.channel.send(f"{response_text[:1997]}...")
-    else:
-        await message.channel.send(response_text)
+    gateway_loop = asyncio.get_running_loop()
+
+    async def on_gateway(coro):
+        # respond() may run on the dispatcher's loop; Discord API calls belong to the gateway's
+        if asyncio.get_running_loop() is gateway_loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, gateway_loop))
+
+    async def respond(prompt_text: str):
+        if core_logic.STREAM_RESPONSES:
+            # Post the reply as soon as the first chunk arrives and edit it as the rest streams in.
+            await relay_stream(
+                core_logic.stream_chat_response(user_id, prompt_text, logger, platform="discord"),
+                send=lambda new_text: on_gateway(message.channel.send(new_text)),
+                edit=lambda sent, new_text: on_gateway(sent.edit(content=new_text)),
+                max_length=DISCORD_MESSAGE_LIMIT,
+                min_edit_interval=DISCORD_STREAM_EDIT_INTERVAL,
+            )
+            return
+
+        # Pass the platform-specific logger to the core logic.
+        # The async variant keeps the gateway event loop free while Gemini and the DB respond.
+        response_text = await core_logic.generate_chat_response_async(user_id, prompt_text, logger, platform="discord")
+
+        # Discord messages have a 2000 character limit.
+        await on_gateway(message.channel.send(truncate_for_platform(response_text, DISCORD_MESSAGE_LIMIT)))
+
+    # The dispatcher answers this user's messages in order and caps concurrent generations.
+    # The deadline counts from when the user sent the message, so a backlog is shed quickly.
+    deadline = core_logic.reply_deadline(message.created_at)
+    try:
+        async with message.channel.typing():
+            await core_logic.dispatcher.submit(user_id, text, respond, deadline=deadline)
+    except DispatcherBusy:
+        await message.channel.send(core_logic.BUSY_MESSAGE)
 
 def main():
     if not DISCORD_BOT_TOKEN:
         logger.error("DISCORD_BOT_TOKEN not found in environment variables. Discord bot cannot start.")
         return
 
+    core_logic.init(logger) # Create the model and DB pool before the first message arrives
+    core_logic.start_metrics_server(logger)
+    if DISCORD_OFFLOAD_GENERATION:
+        core_logic.dispatcher.start_background_loop()
     logger.info("Starting Discord bot...")
     try:
         bot.run(DISCORD_BOT_TOKEN)
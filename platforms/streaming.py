@@ -0,0 +1,53 @@
+# gemini_multichat_bot/platforms/streaming.py
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def truncate_for_platform(text: str, max_length: int) -> str:
+    """Cuts text to the platform's message length limit, marking the cut with '...'."""
+    if len(text) > max_length:
+        return f"{text[:max_length - 3]}..."
+    return text
+
+
+async def relay_stream(chunks, send, edit, max_length: int, min_edit_interval: float) -> str:
+    """
+    Shows a streamed reply progressively in a single chat message.
+
+    The message is posted as soon as the first chunk arrives (send(text) -> message)
+    and then edited with the accumulated text (edit(message, text)), at most once per
+    min_edit_interval seconds so we stay within the platform's edit rate limits.
+    A final edit always shows the complete text. Returns the full text.
+    """
+    full_text = ""
+    message = None
+    shown_text = ""
+    last_edit = 0.0
+
+    async for chunk in chunks:
+        full_text += chunk
+        display_text = truncate_for_platform(full_text, max_length)
+        if not display_text.strip():
+            continue
+        if message is None:
+            message = await send(display_text)
+            shown_text = display_text
+            last_edit = time.monotonic()
+        elif display_text != shown_text and time.monotonic() - last_edit >= min_edit_interval:
+            try:
+                await edit(message, display_text)
+                shown_text = display_text
+            except Exception as e:
+                # A rejected intermediate edit (e.g. rate limited) is not fatal; the final edit catches up
+                logger.warning(f"Intermediate streaming edit failed: {e}")
+            last_edit = time.monotonic()
+
+    display_text = truncate_for_platform(full_text, max_length)
+    if message is None:
+        await send(display_text or "Sorry, I couldn't come up with a response.")
+    elif display_text != shown_text:
+        await edit(message, display_text)
+    return full_text
@@ -1,5 +1,6 @@
 # gemini_multichat_bot/platforms/telegram_bot.py
 
+import asyncio
 import logging
 import os
 import re # For parsing due date in add_task_command
@@ -10,12 +11,30 @@ import pytz # Import pytz
 
 # Import core logic
 from core import main as core_logic # Assuming core.main has the chatbot logic
+from core import retention
+from core.dispatcher import DispatcherBusy
+from platforms.streaming import relay_stream, truncate_for_platform
 
 # .env loading is now primarily handled by core/main.py
 # However, TELEGRAM_BOT_TOKEN is needed here before Application setup.
 # Ensure .env is loaded early enough for all modules.
 # The load_dotenv in core/main.py should make TELEGRAM_BOT_TOKEN available if .env is correct.
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram throttles bots that edit the same chat more than about once per second
+TELEGRAM_STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.5"))
+# Webhook mode: Telegram POSTs updates to us instead of one worker long-polling for them,
+# so several instances can run behind a load balancer. Each request must carry the
+# X-Telegram-Bot-Api-Secret-Token header matching TELEGRAM_WEBHOOK_SECRET.
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling").lower() # "polling" or "webhook"
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL") # Public base URL, e.g. https://bot.example.com
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "telegram_webhook").strip("/")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", os.getenv("PORT", "8443")))
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+# Updates handled at once per instance (handle_message mostly waits on Gemini)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "256"))
 # If TELEGRAM_BOT_TOKEN is still None here, it means .env wasn't loaded before this line,
 # or the token is missing from .env. core/main.py's load_dotenv should cover it.
 
@@ -25,6 +44,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def claim_update(update: Update) -> tuple:
+    """
+    In webhook mode Telegram retries a delivery it considers failed, possibly on another
+    instance; claim the update_id so a retry never produces a second reply. Returns
+    (is_new, dedup_key); dedup_key is None when nothing was claimed.
+    """
+    if not use_webhook() or not core_logic.message_dedup:
+        return True, None
+    dedup_key = f"telegram:{update.update_id}"
+    user_id = str(update.effective_user.id)
+    is_new, _ = await core_logic.run_db_call(core_logic.message_dedup.claim, dedup_key, user_id)
+    if not is_new:
+        logger.info(f"Ignoring redelivered Telegram update {update.update_id} from {user_id}.")
+    return is_new, dedup_key
+
+async def finish_update(dedup_key: str, succeeded: bool = True) -> None:
+    """Completes a claim from claim_update(), or releases it so a retry is answered."""
+    if not dedup_key:
+        return
+    if succeeded:
+        await core_logic.run_db_call(core_logic.message_dedup.complete, dedup_key)
+    else:
+        await core_logic.run_db_call(core_logic.message_dedup.release, dedup_key)
+
+async def reply_once(update: Update, send) -> None:
+    """Runs send() for a command at most once per update_id (see claim_update)."""
+    is_new, dedup_key = await claim_update(update)
+    if not is_new:
+        return
+    try:
+        await send()
+    except Exception:
+        await finish_update(dedup_key, succeeded=False)
+        raise
+    await finish_update(dedup_key)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a welcome message when the /start command is issued."""
     user = update.effective_user
@@ -33,7 +88,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "Feel free to ask me anything or just say hello!\n\n"
         "Type /help for more information."
     )
-    await update.message.reply_html(welcome_message)
+    await reply_once(update, lambda: update.message.reply_html(welcome_message))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends a help message when the /help command is issued."""
@@ -45,24 +100,96 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "  /help - Show this help message.\n\n"
         "Just type your message, and I'll do my best to respond!"
     )
-    await update.message.reply_html(help_text, disable_web_page_preview=True)
+    await reply_once(update, lambda: update.message.reply_html(help_text, disable_web_page_preview=True))
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles non-command messages using Gemini."""
     user_id = str(update.effective_user.id)
     text = update.message.text
 
-    # Use the new generate_chat_response function from core_logic
-    # Pass the platform-specific logger
-    response_text = core_logic.generate_chat_response(user_id, text, logger)
-    await update.message.reply_text(response_text)
+    async def respond(prompt_text: str):
+        if core_logic.STREAM_RESPONSES:
+            # Post the reply as soon as the first chunk arrives and edit it as the rest streams in.
+            await relay_stream(
+                core_logic.stream_chat_response(user_id, prompt_text, logger, platform="telegram"),
+                send=update.message.reply_text,
+                edit=lambda sent, new_text: sent.edit_text(new_text),
+                max_length=TELEGRAM_MESSAGE_LIMIT,
+                min_edit_interval=TELEGRAM_STREAM_EDIT_INTERVAL,
+            )
+            return
 
+        # Use the awaitable generate_chat_response_async so a slow reply for one user
+        # does not block the event loop for everyone else. Pass the platform-specific logger.
+        response_text = await core_logic.generate_chat_response_async(user_id, prompt_text, logger, platform="telegram")
+        await update.message.reply_text(truncate_for_platform(response_text, TELEGRAM_MESSAGE_LIMIT))
 
-def main() -> None:
-    """Start the bot."""
+    is_new, dedup_key = await claim_update(update)
+    if not is_new:
+        return
+
+    # The dispatcher answers this user's messages in order and caps concurrent generations.
+    # The deadline counts from when the user sent the message, so a backlog is shed quickly.
+    deadline = core_logic.reply_deadline(update.message.date)
+    try:
+        await core_logic.dispatcher.submit(user_id, text, respond, deadline=deadline)
+    except DispatcherBusy:
+        # Not remembered as answered: a redelivered update should get a real reply
+        try:
+            await update.message.reply_text(core_logic.BUSY_MESSAGE)
+        finally:
+            await finish_update(dedup_key, succeeded=False)
+        return
+    except Exception:
+        await finish_update(dedup_key, succeeded=False)
+        raise
+    await finish_update(dedup_key)
+
+
+def use_webhook() -> bool:
+    return TELEGRAM_MODE == "webhook"
+
+
+def webhook_options():
+    """
+    Keyword arguments for run_webhook() / Updater.start_webhook(), or None (after logging
+    why) if webhook mode is not fully configured.
+    """
+    if not TELEGRAM_WEBHOOK_URL:
+        logger.error("TELEGRAM_MODE=webhook needs TELEGRAM_WEBHOOK_URL (the bot's public base URL).")
+        return None
+    if not TELEGRAM_WEBHOOK_SECRET:
+        logger.error("TELEGRAM_MODE=webhook needs TELEGRAM_WEBHOOK_SECRET; refusing to accept unauthenticated updates.")
+        return None
+    return {
+        "listen": TELEGRAM_WEBHOOK_LISTEN,
+        "port": TELEGRAM_WEBHOOK_PORT,
+        "url_path": TELEGRAM_WEBHOOK_PATH,
+        "webhook_url": f"{TELEGRAM_WEBHOOK_URL.rstrip('/')}/{TELEGRAM_WEBHOOK_PATH}",
+        "secret_token": TELEGRAM_WEBHOOK_SECRET,
+        "max_connections": TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+        "allowed_updates": ["message"], # The only update type we handle
+    }
+
+
+def prepare_webhook_instance():
+    """
+    Webhook mode exists to run several instances behind a load balancer, where a user's
+    consecutive updates may land on different instances: each one must read history from
+    the shared store instead of its own in-process cache.
+    """
+    core_logic.disable_history_cache(logger, "TELEGRAM_MODE=webhook may run several instances")
+
+
+def build_application(request=None):
+    """
+    Builds the Telegram Application with all handlers, or returns None without a token.
+    `request` (a telegram.request.BaseRequest) replaces the HTTP client used for Bot API
+    calls, e.g. with an offline fake in tools/replay_telegram_updates.py.
+    """
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN not found in environment variables. Bot cannot start.")
-        return
+        return None
 
     # Create the Application and pass it your bot's token.
     # Explicitly create JobQueue with a timezone to address apscheduler issue
@@ -78,7 +205,17 @@ def main() -> None:
         except Exception as e:
             logger.warning(f"Could not directly configure job_queue scheduler timezone: {e}. Relying on defaults.")
     
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).job_queue(job_queue).build()
+    # concurrent_updates lets handle_message for different users overlap instead of
+    # processing updates strictly one after another.
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .job_queue(job_queue)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
 
     # Command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -87,10 +224,41 @@ def main() -> None:
 
     # Message handler for general text (to be processed by Gemini)
     # This remains the same as it uses core_logic.generate_chat_response
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    logger.info("Starting Telegram bot (Chat Mode)...")
-    application.run_polling()
+    # Edited messages are not answered again (handle_message reads update.message)
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_message))
+
+    if core_logic.database_connections(logger) and retention.RETENTION_INTERVAL_SECONDS > 0:
+        application.job_queue.run_repeating(
+            retention_job, interval=retention.RETENTION_INTERVAL_SECONDS, first=60, name="history_retention"
+        )
+    return application
+
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Prunes old chat history off the event loop (the deletes are blocking psycopg2 calls)."""
+    await asyncio.to_thread(retention.run_retention, logger)
+
+
+def main() -> None:
+    """Start the bot."""
+    application = build_application()
+    if application is None:
+        return
+    core_logic.init(logger) # Create the model and DB pool before the first update arrives
+    core_logic.start_metrics_server(logger)
+
+    if use_webhook():
+        options = webhook_options()
+        if options is None:
+            return
+        prepare_webhook_instance()
+        logger.info(f"Starting Telegram bot (Chat Mode) with a webhook on port {options['port']}...")
+        application.run_webhook(**options)
+    else:
+        if TELEGRAM_MODE != "polling":
+            logger.warning(f"Unknown TELEGRAM_MODE '{TELEGRAM_MODE}'; using polling.")
+        logger.info("Starting Telegram bot (Chat Mode)...")
+        application.run_polling()
     logger.info("Telegram bot stopped.")
 
 if __name__ == "__main__":
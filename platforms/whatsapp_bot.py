@@ -3,12 +3,18 @@
 from flask import Flask, request, Response
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 import logging
 from dotenv import load_dotenv
 
 # Import core logic
 from core import main as core_logic
+from core.dispatcher import DispatcherBusy
+from core.metrics import PROMETHEUS_CONTENT_TYPE, registry as metrics_registry
 
 # Load environment variables
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
@@ -16,7 +22,17 @@ load_dotenv(dotenv_path=dotenv_path)
 
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-# TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER") # This is your Twilio WhatsApp number
+TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER") # This is your Twilio WhatsApp number
+
+# With async replies the webhook acknowledges Twilio with an empty TwiML response right
+# away and the reply is sent later through the Twilio REST API, so slow generations never
+# hit Twilio's webhook timeout or hold a gunicorn worker.
+WHATSAPP_ASYNC_REPLIES = os.getenv("WHATSAPP_ASYNC_REPLIES", "true").lower() in ("1", "true", "yes")
+TWILIO_SEND_WORKERS = int(os.getenv("TWILIO_SEND_WORKERS", "8")) # Concurrent outbound REST calls
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "10"))
+# Inline (TwiML) replies must be ready before Twilio gives up on the webhook after 15 seconds
+WHATSAPP_INLINE_REPLY_DEADLINE = float(os.getenv("WHATSAPP_INLINE_REPLY_DEADLINE", "12"))
+WHATSAPP_MESSAGE_LIMIT = 1600 # Twilio rejects WhatsApp bodies longer than this
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -25,12 +41,83 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Twilio client (optional here if only receiving, but good for sending replies)
-# client = None
-# if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-#     client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-# else:
-#     logger.warning("Twilio credentials not found. Sending replies might not work.")
+# Initialize Twilio client (used to send replies out of band in async mode).
+# One client with a pooled requests session is shared by all sends, so outbound
+# messages reuse keep-alive HTTPS connections instead of a new TLS handshake each time.
+client = None
+if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+    twilio_http_client = TwilioHttpClient(pool_connections=True, timeout=TWILIO_HTTP_TIMEOUT)
+    twilio_http_client.session.mount("https://", HTTPAdapter(pool_maxsize=TWILIO_SEND_WORKERS, max_retries=2))
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=twilio_http_client)
+else:
+    logger.warning("Twilio credentials not found. Sending replies might not work.")
+
+use_async_replies = WHATSAPP_ASYNC_REPLIES and client is not None and bool(TWILIO_WHATSAPP_NUMBER)
+if WHATSAPP_ASYNC_REPLIES and not use_async_replies:
+    logger.warning("Async WhatsApp replies need Twilio credentials and TWILIO_WHATSAPP_NUMBER; replying inline via TwiML.")
+
+_send_executor = ThreadPoolExecutor(max_workers=TWILIO_SEND_WORKERS, thread_name_prefix="twilio-send")
+
+
+def split_whatsapp_message(text: str) -> list:
+    """Splits a reply into chunks Twilio accepts, preferring to break at line or word boundaries."""
+    chunks = []
+    while len(text) > WHATSAPP_MESSAGE_LIMIT:
+        cut = text.rfind("\n", 0, WHATSAPP_MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, WHATSAPP_MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = WHATSAPP_MESSAGE_LIMIT
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+def send_whatsapp_message(to: str, text: str):
+    """Sends a reply through the Twilio REST API (blocking)."""
+    for chunk in split_whatsapp_message(text):
+        client.messages.create(from_=TWILIO_WHATSAPP_NUMBER, to=to, body=chunk)
+
+def queue_whatsapp_reply(user_id: str, message_body: str, message_sid: str = None):
+    """
+    Hands the message to the dispatcher's worker loop and returns immediately.
+    The reply is generated and sent out of band via the Twilio REST API.
+    """
+    async def respond(prompt_text: str) -> str:
+        response_text = await core_logic.generate_chat_response_async(user_id, prompt_text, logger, platform="whatsapp")
+        # Send from inside the handler so replies to one sender go out in order
+        await asyncio.get_running_loop().run_in_executor(_send_executor, send_whatsapp_message, user_id, response_text)
+        return response_text
+
+    def finish(future):
+        dedup = core_logic.message_dedup if message_sid else None
+        try:
+            reply_text = future.result()
+        except DispatcherBusy:
+            reply_text = core_logic.BUSY_MESSAGE
+            try:
+                send_whatsapp_message(user_id, reply_text)
+            except Exception as e:
+                logger.error(f"Failed to send the busy reply to WhatsApp user {user_id}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to reply to WhatsApp message from {user_id}: {e}")
+            reply_text = None
+        if not dedup:
+            return
+        # Busy replies are not remembered, so a redelivery of the message gets a real answer
+        if reply_text is None or reply_text == core_logic.BUSY_MESSAGE:
+            dedup.release(message_sid)
+        else:
+            dedup.complete(message_sid, reply_text)
+
+    def on_done(future):
+        # Runs on the dispatcher's event loop (shared with Telegram/Discord under core.run);
+        # the busy reply and the dedup bookkeeping block on Twilio and Postgres.
+        _send_executor.submit(finish, future)
+
+    deadline = core_logic.reply_deadline()
+    core_logic.dispatcher.submit_background(user_id, message_body, respond, deadline=deadline).add_done_callback(on_done)
 
 
 def process_whatsapp_message(user_id: str, message_body: str) -> str:
@@ -54,7 +141,16 @@ def process_whatsapp_message(user_id: str, message_body: str) -> str:
     # The SYSTEM_INSTRUCTION in core_logic.py will guide the model's general behavior.
     # The user_id for WhatsApp will be their phone number (e.g., "whatsapp:+14155238886")
     # Pass the platform-specific logger
-    response_text = core_logic.generate_chat_response(user_id, message_body, logger)
+    # Submitting through the dispatcher keeps each sender's messages in order and caps
+    # concurrent generations across all webhook threads of this worker.
+    async def respond(prompt_text: str) -> str:
+        return await core_logic.generate_chat_response_async(user_id, prompt_text, logger, platform="whatsapp")
+
+    deadline = core_logic.reply_deadline(budget=WHATSAPP_INLINE_REPLY_DEADLINE)
+    try:
+        response_text = core_logic.dispatcher.submit_threadsafe(user_id, message_body, respond, deadline=deadline)
+    except DispatcherBusy:
+        return core_logic.BUSY_MESSAGE
     return response_text
 
 @app.route("/whatsapp_webhook", methods=["POST"])
@@ -64,6 +160,7 @@ def whatsapp_webhook():
     """
     incoming_msg = request.values.get('Body', '').strip()
     sender_id = request.values.get('From', '') # e.g., 'whatsapp:+14155238886'
+    message_sid = request.values.get('MessageSid') # Stays the same when Twilio retries the webhook
     
     logger.info(f"Received WhatsApp message from {sender_id}: {incoming_msg}")
 
@@ -71,20 +168,59 @@ def whatsapp_webhook():
         logger.warning("Received empty message or no sender ID.")
         return Response(status=400) # Bad request
 
-    # Process the message using our core logic / Gemini
-    reply_text = process_whatsapp_message(sender_id, incoming_msg)
+    dedup = core_logic.message_dedup if message_sid else None
+    if dedup:
+        is_new, cached_reply = dedup.claim(message_sid, sender_id)
+        if not is_new:
+            logger.info(f"Suppressed duplicate delivery of WhatsApp message {message_sid}.")
+            twiml_response = MessagingResponse()
+            # Async replies were already sent through the REST API; only inline mode repeats them
+            if cached_reply and not use_async_replies:
+                twiml_response.message(cached_reply)
+            return Response(str(twiml_response), mimetype="application/xml")
+
+    if use_async_replies:
+        # Acknowledge right away; the reply is sent via the REST API once it is ready
+        queue_whatsapp_reply(sender_id, incoming_msg, message_sid)
+        return Response(str(MessagingResponse()), mimetype="application/xml")
 
-    # Create a TwiML response
+    # Process the message using our core logic / Gemini
+    try:
+        reply_text = process_whatsapp_message(sender_id, incoming_msg)
+    except Exception:
+        if dedup:
+            dedup.release(message_sid) # Let Twilio's retry try again
+        raise
+    if dedup:
+        if reply_text == core_logic.BUSY_MESSAGE:
+            dedup.release(message_sid) # Twilio's retry should get a real reply, not the busy one
+        else:
+            dedup.complete(message_sid, reply_text)
+
+    # Create a TwiML response. No reply text means the message was merged into a later one.
     twiml_response = MessagingResponse()
-    twiml_response.message(reply_text)
+    if reply_text:
+        twiml_response.message(reply_text)
 
     return Response(str(twiml_response), mimetype="application/xml")
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage latency histograms, token counters, pool/cache/queue gauges."""
+    return Response(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Health check for the load balancer: 200 if the model and database are usable, else 503."""
+    healthy, details = core_logic.health_status()
+    return details, (200 if healthy else 503)
+
 def main():
     """
     Runs the Flask app for the WhatsApp bot.
     Note: For production, use a proper WSGI server like Gunicorn or Waitress.
     """
+    core_logic.init(logger) # Create the model and DB pool before the first webhook arrives
     logger.info("Starting WhatsApp bot (Flask server)...")
     # Make sure to configure your Twilio WhatsApp number's webhook
     # to point to this server's /whatsapp_webhook endpoint (e.g., using ngrok for local dev).
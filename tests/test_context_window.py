@@ -0,0 +1,30 @@
+# gemini_multichat_bot/tests/test_context_window.py
+
+from core.context_window import SUMMARY_PREFIX, build_prompt_window
+
+
+def history(count: int, chars: int = 40) -> list:
+    return [
+        {"id": i, "role": "user" if i % 2 else "model", "content": "x" * chars}
+        for i in range(1, count + 1)
+    ]
+
+
+def test_window_keeps_the_newest_records_that_fit():
+    window = build_prompt_window(history(10), None, "hi", token_budget=41)
+    assert [record["id"] for record in window.overflow] == [1, 2, 3, 4, 5, 6]
+    assert len(window.contents) == 4
+    assert window.contents[0]["role"] == "user"
+
+
+def test_summarized_records_are_not_sent_again():
+    window = build_prompt_window(history(10), ("earlier", 4), "hi", token_budget=10000)
+    assert window.contents[0]["parts"][0] == SUMMARY_PREFIX + "earlier"
+    assert [record["id"] for record in window.overflow] == [1, 2, 3, 4]
+    assert len(window.contents) == 2 + 6
+
+
+def test_window_never_opens_with_a_model_reply():
+    window = build_prompt_window(history(10), ("earlier", 5), "hi", token_budget=10000)
+    assert [record["id"] for record in window.overflow] == [1, 2, 3, 4, 5, 6]
+    assert window.contents[2]["role"] == "user"
@@ -0,0 +1,142 @@
+# gemini_multichat_bot/tests/test_dispatcher.py
+
+import asyncio
+import time
+
+import pytest
+
+from core.dispatcher import ChatDispatcher, DeadlineExceeded, DispatcherBusy, request_deadline
+
+
+def test_messages_of_one_user_run_in_order_without_overlap():
+    events = []
+
+    async def handler(text):
+        events.append(("start", text))
+        await asyncio.sleep(0.01)
+        events.append(("end", text))
+        return text.upper()
+
+    async def main():
+        dispatcher = ChatDispatcher(max_concurrent=4)
+        return await asyncio.gather(*(dispatcher.submit("u1", text, handler) for text in ("a", "b", "c")))
+
+    assert asyncio.run(main()) == ["A", "B", "C"]
+    assert events == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+
+
+def test_different_users_run_concurrently_up_to_the_limit():
+    running = []
+    peak = []
+
+    async def handler(text):
+        running.append(text)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(text)
+
+    async def main():
+        dispatcher = ChatDispatcher(max_concurrent=2)
+        await asyncio.gather(*(dispatcher.submit(f"user{i}", str(i), handler) for i in range(4)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+
+
+def test_message_past_its_deadline_is_shed_on_arrival():
+    async def handler(text):
+        raise AssertionError("must not run")
+
+    async def main():
+        dispatcher = ChatDispatcher()
+        with pytest.raises(DeadlineExceeded):
+            await dispatcher.submit("u1", "late", handler, deadline=time.monotonic() - 1)
+        return dispatcher.stats()
+
+    stats = asyncio.run(main())
+    assert stats["shed"]["expired_on_arrival"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_full_user_queue_is_rejected():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(text):
+            await gate.wait()
+            return text
+
+        dispatcher = ChatDispatcher(max_queued_per_user=1)
+        first = asyncio.ensure_future(dispatcher.submit("u1", "1", handler))
+        await asyncio.sleep(0) # Let the first message start
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(dispatcher.submit("u1", "2", handler))
+        await asyncio.sleep(0)
+        with pytest.raises(DispatcherBusy):
+            await dispatcher.submit("u1", "3", handler)
+        gate.set()
+        assert await asyncio.gather(first, second) == ["1", "2"]
+        return dispatcher.stats()
+
+    assert asyncio.run(main())["shed"]["user_queue_full"] == 1
+
+
+def test_message_that_waited_past_its_deadline_is_shed_in_queue():
+    async def main():
+        async def slow(text):
+            await asyncio.sleep(0.1)
+
+        async def handler(text):
+            raise AssertionError("must not run")
+
+        dispatcher = ChatDispatcher(max_concurrent=1)
+        busy = asyncio.ensure_future(dispatcher.submit("u1", "slow", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await dispatcher.submit("u2", "waits", handler, deadline=time.monotonic() + 0.02)
+        await busy
+        return dispatcher.stats()
+
+    assert asyncio.run(main())["shed"]["expired_in_queue"] == 1
+
+
+def test_handler_sees_the_request_deadline():
+    seen = []
+
+    async def handler(text):
+        seen.append(request_deadline.get())
+
+    async def main():
+        deadline = time.monotonic() + 30
+        await ChatDispatcher().submit("u1", "hi", handler, deadline=deadline)
+        return deadline
+
+    assert seen == [asyncio.run(main())]
+
+
+def test_cancelled_drain_cancels_queued_messages():
+    async def main():
+        async def handler(text):
+            await asyncio.sleep(10)
+
+        dispatcher = ChatDispatcher(max_concurrent=1)
+        submissions = [asyncio.ensure_future(dispatcher.submit("u1", str(i), handler)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        for task in asyncio.all_tasks():
+            if task.get_coro().__name__ == "_drain":
+                task.cancel()
+        results = await asyncio.gather(*submissions, return_exceptions=True)
+        return results, dispatcher.stats()
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert stats["queued"] == 0
+    assert stats["active_users"] == 0
+
+
+def test_submit_threadsafe_runs_on_the_background_loop():
+    async def handler(text):
+        return f"re: {text}"
+
+    dispatcher = ChatDispatcher()
+    assert dispatcher.submit_threadsafe("u1", "hi", handler, timeout=5) == "re: hi"
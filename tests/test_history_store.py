@@ -0,0 +1,188 @@
+# gemini_multichat_bot/tests/test_history_store.py
+
+import datetime
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("psycopg2") # core.history_store imports it for the Postgres backends
+
+from core.history_store import (HistoryStoreError, MemoryHistoryStore, ShardedHistoryStore,
+                                SQLiteHistoryStore)
+from core.sharding import HashRing
+
+NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def turn(user_id: str, *texts) -> list:
+    roles = ("user", "model")
+    return [(user_id, {"id": None, "role": roles[i % 2], "content": text}, NOW) for i, text in enumerate(texts)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryHistoryStore(max_messages_per_user=50)
+    else:
+        store = SQLiteHistoryStore(str(tmp_path / "history.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_rows_load_back_in_order_with_ids(store):
+    rows = turn("u1", "hi", "hello", "how are you", "fine")
+    store.write_rows(rows)
+    records, summary = store.load("u1", 10)
+    assert [record["content"] for record in records] == ["hi", "hello", "how are you", "fine"]
+    assert [record["id"] for record in records] == [row[1]["id"] for row in rows]
+    assert summary is None
+
+
+def test_load_returns_the_most_recent_rows(store):
+    store.write_rows(turn("u1", "1", "2", "3", "4"))
+    records, _ = store.load("u1", 2)
+    assert [record["content"] for record in records] == ["3", "4"]
+
+
+def test_users_are_kept_apart(store):
+    store.write_rows(turn("u1", "mine") + turn("u2", "theirs"))
+    assert [record["content"] for record in store.load("u1", 10)[0]] == ["mine"]
+    assert store.load("nobody", 10) == ([], None)
+
+
+def test_summary_is_never_replaced_by_an_older_one(store):
+    store.write_rows(turn("u1", "a", "b", "c", "d"))
+    store.save_summary("u1", "newer", 4)
+    store.save_summary("u1", "older", 2)
+    assert store.load("u1", 10)[1] == ("newer", 4)
+
+
+def test_memory_store_keeps_a_ring_buffer_per_user():
+    store = MemoryHistoryStore(max_messages_per_user=2)
+    store.write_rows(turn("u1", "1", "2", "3"))
+    assert [record["content"] for record in store.load("u1", 10)[0]] == ["2", "3"]
+
+
+def test_memory_store_needs_room_for_one_message():
+    with pytest.raises(ValueError):
+        MemoryHistoryStore(max_messages_per_user=0)
+
+
+def test_memory_store_drops_least_recently_active_users_over_the_byte_cap():
+    store = MemoryHistoryStore(max_messages_per_user=10, max_bytes=600)
+    store.write_rows(turn("old", "x" * 100))
+    store.write_rows(turn("new", "y" * 100))
+    store.write_rows(turn("new", "z" * 100))
+    assert store.load("old", 10) == ([], None)
+    assert store.stats()["evicted_users"] == 1
+    assert store.stats()["bytes"] <= 600
+
+
+def test_sqlite_close_closes_every_thread_connection(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.sqlite3"))
+    writers = [threading.Thread(target=store.write_rows, args=(turn(f"u{i}", "hi"),)) for i in range(3)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    connections = list(store._connections)
+    assert len(connections) == 3
+    store.close()
+    for conn in connections:
+        with pytest.raises(Exception):
+            conn.execute("SELECT 1")
+    # Still usable afterwards: the thread reconnects
+    assert len(store.load("u0", 10)[0]) == 1
+    store.close()
+
+
+class FakeCursor:
+    def __init__(self, moved: set):
+        self._moved = moved
+        self._row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        self._row = (1,) if params[0] in self._moved else None
+
+    def fetchone(self):
+        return self._row
+
+
+class FakeConnection:
+    def __init__(self, moved: set):
+        self._moved = moved
+
+    def cursor(self):
+        return FakeCursor(self._moved)
+
+    def rollback(self):
+        pass
+
+
+class FakeShard(MemoryHistoryStore):
+    """A shard with the move markers (chat_history_moves) of a real one."""
+
+    def __init__(self, fail: bool = False):
+        super().__init__()
+        self.moved = set()
+        self.fail = fail
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self.moved)
+
+    def write_rows(self, rows: list):
+        if self.fail:
+            raise HistoryStoreError("shard is down")
+        super().write_rows(rows)
+
+
+def user_moving_from(previous: HashRing, ring: HashRing, source: str, destination: str) -> str:
+    return next(
+        user_id for user_id in (f"user{i}" for i in range(10000))
+        if previous.node_for(user_id) == source and ring.node_for(user_id) == destination
+    )
+
+
+def test_sharded_store_routes_each_user_to_its_shard():
+    shards = {"a": FakeShard(), "b": FakeShard()}
+    ring = HashRing(["a", "b"])
+    store = ShardedHistoryStore(shards, ring)
+    users = [f"user{i}" for i in range(20)]
+    store.write_rows([row for user_id in users for row in turn(user_id, "hi")])
+    for user_id in users:
+        owner = ring.node_for(user_id)
+        other = "b" if owner == "a" else "a"
+        assert len(shards[owner].load(user_id, 10)[0]) == 1
+        assert shards[other].load(user_id, 10) == ([], None)
+
+
+def test_sharded_store_keeps_moving_users_on_the_old_shard_until_copied():
+    shards = {"a": FakeShard(), "b": FakeShard()}
+    previous, ring = HashRing(["a"]), HashRing(["a", "b"])
+    store = ShardedHistoryStore(shards, ring, previous_ring=previous)
+    user_id = user_moving_from(previous, ring, "a", "b")
+    assert store.shard_for(user_id) == "a"
+    shards["b"].moved.add(user_id) # The rebalance tool copied the user
+    assert store.shard_for(user_id) == "b"
+    assert store.stats()["rebalance"] == {"moved_users_seen": 1, "routed_to_previous": 1}
+
+
+def test_sharded_write_keeps_ids_of_rows_saved_on_healthy_shards():
+    shards = {"a": FakeShard(), "b": FakeShard(fail=True)}
+    ring = HashRing(["a", "b"])
+    store = ShardedHistoryStore(shards, ring)
+    on_a = next(f"user{i}" for i in range(100) if ring.node_for(f"user{i}") == "a")
+    on_b = next(f"user{i}" for i in range(100) if ring.node_for(f"user{i}") == "b")
+    rows = turn(on_a, "saved") + turn(on_b, "lost")
+    with pytest.raises(HistoryStoreError):
+        store.write_rows(rows)
+    assert rows[0][1]["id"] is not None
+    assert rows[1][1]["id"] is None
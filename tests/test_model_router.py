@@ -0,0 +1,72 @@
+# gemini_multichat_bot/tests/test_model_router.py
+
+import asyncio
+
+import pytest
+
+from core.fake_model import FakeGenerativeModel, FakeInvalidRequestError, FakeModelError
+from core.model_router import FAST, STRONG, ModelBackend, ModelRouter
+from core.resilience import CircuitBreaker, GuardedModel, TokenBucket
+
+
+def backend(name: str, tier: str = FAST, **fake_options) -> ModelBackend:
+    model = GuardedModel(
+        FakeGenerativeModel(model_name=name, latency=0.0, seed=1, **fake_options),
+        TokenBucket(0, 1), CircuitBreaker(failure_threshold=1, recovery_timeout=60.0),
+        max_attempts=1, base_delay=0.0,
+    )
+    return ModelBackend(name, tier, model)
+
+
+def test_short_messages_go_to_fast_and_code_to_strong():
+    router = ModelRouter([backend("fast"), backend("strong", STRONG)], short_message_chars=20)
+    assert router.classify("hello") == FAST
+    assert router.classify("x" * 21) == STRONG
+    assert router.classify("```print(1)```") == STRONG
+
+
+def test_upstream_failure_fails_over_to_the_next_backend():
+    broken, healthy = backend("broken", error_rate=1.0), backend("healthy")
+    router = ModelRouter([broken, healthy])
+    response = router.generate_content("hi")
+    assert response.text.startswith("Echo: hi")
+    stats = router.stats()
+    assert stats["failovers"] == 1
+    assert stats["backends"]["broken"]["failures"] == 1
+    assert stats["backends"]["healthy"]["calls"] == 1
+
+
+def test_open_circuit_backends_are_tried_last():
+    broken, healthy = backend("broken", error_rate=1.0), backend("healthy")
+    router = ModelRouter([broken, healthy])
+    router.generate_content("hi") # Opens the broken backend's breaker
+    router.generate_content("hi again")
+    assert router.stats()["failovers"] == 1
+    assert broken.stats()["calls"] == 1
+    assert healthy.stats()["calls"] == 2
+
+
+def test_other_tier_is_used_when_the_tier_fails():
+    router = ModelRouter([backend("fast", error_rate=1.0), backend("strong", STRONG)])
+    assert router.generate_content("hi", tier=FAST).text.startswith("Echo: hi")
+
+
+def test_errors_are_raised_when_every_backend_fails():
+    router = ModelRouter([backend("a", error_rate=1.0), backend("b", error_rate=1.0)])
+    with pytest.raises(FakeModelError):
+        router.generate_content("hi")
+
+
+def test_invalid_requests_do_not_fail_over():
+    first, second = backend("first", invalid_error_rate=1.0), backend("second")
+    router = ModelRouter([first, second])
+    with pytest.raises(FakeInvalidRequestError):
+        router.generate_content("hi")
+    assert second.stats()["calls"] == 0
+
+
+def test_async_failover():
+    router = ModelRouter([backend("broken", error_rate=1.0), backend("healthy")])
+    response = asyncio.run(router.generate_content_async("hi"))
+    assert response.text.startswith("Echo: hi")
+    assert router.stats()["failovers"] == 1
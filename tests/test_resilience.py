@@ -0,0 +1,149 @@
+# gemini_multichat_bot/tests/test_resilience.py
+
+import asyncio
+
+import pytest
+
+from core.fake_model import FakeGenerativeModel, FakeInvalidRequestError, FakeModelError
+from core.resilience import CircuitBreaker, CircuitOpenError, GuardedModel, TokenBucket
+
+
+def guarded(model, failure_threshold: int = 2, max_attempts: int = 3) -> GuardedModel:
+    breaker = CircuitBreaker(failure_threshold=failure_threshold, recovery_timeout=0.0)
+    return GuardedModel(model, TokenBucket(0, 1), breaker, max_attempts=max_attempts, base_delay=0.0, max_delay=0.0)
+
+
+def open_breaker(recovery_timeout: float = 0.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=recovery_timeout)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_rejects_calls():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_while_closed_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_success_of_an_older_call_does_not_close_an_open_breaker():
+    breaker = open_breaker(recovery_timeout=60.0)
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["closed"] == 0
+
+
+def test_half_open_lets_one_trial_through_and_closes_on_success():
+    breaker = open_breaker()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow() # The trial is still in flight
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    stats = breaker.stats()
+    assert (stats["opened"], stats["half_opened"], stats["closed"]) == (1, 1, 1)
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = open_breaker(recovery_timeout=0.0)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_neutral_outcome_frees_the_trial_slot():
+    breaker = open_breaker()
+    assert breaker.allow()
+    breaker.record_neutral()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.accepting()
+
+
+def test_retried_call_counts_as_one_breaker_failure():
+    model = guarded(FakeGenerativeModel(latency=0.0, error_rate=1.0, seed=1))
+    with pytest.raises(FakeModelError):
+        model.generate_content("hi")
+    stats = model.stats()
+    assert stats["calls"]["retries"] == 2
+    assert stats["breaker"]["failures"] == 1
+    assert stats["breaker"]["state"] == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_is_not_retried():
+    model = guarded(FakeGenerativeModel(latency=0.0, error_rate=1.0, seed=1), failure_threshold=1)
+    with pytest.raises(FakeModelError):
+        model.generate_content("hi") # Gives up after its retries and opens the breaker
+    retries = model.stats()["calls"]["retries"]
+    with pytest.raises(FakeModelError):
+        model.generate_content("hi") # The half-open trial
+    assert model.stats()["calls"]["retries"] == retries
+    assert model.breaker.state == CircuitBreaker.OPEN
+
+
+def test_invalid_request_is_neither_retried_nor_counted():
+    model = guarded(FakeGenerativeModel(latency=0.0, invalid_error_rate=1.0, seed=1))
+    with pytest.raises(FakeInvalidRequestError):
+        model.generate_content("hi")
+    stats = model.stats()
+    assert stats["calls"]["retries"] == 0
+    assert stats["breaker"]["failures"] == 0
+
+
+def test_open_breaker_fails_fast():
+    model = guarded(FakeGenerativeModel(latency=0.0))
+    model.breaker = open_breaker(recovery_timeout=60.0)
+    with pytest.raises(CircuitOpenError):
+        model.generate_content("hi")
+
+
+def test_abandoned_stream_ends_the_half_open_trial():
+    model = guarded(FakeGenerativeModel(latency=0.0))
+    model.breaker = open_breaker()
+    stream = iter(model.generate_content("hi", stream=True))
+    next(stream)
+    stream.close() # GeneratorExit inside the wrapper
+    assert model.breaker.state == CircuitBreaker.HALF_OPEN
+    assert model.breaker.accepting()
+
+
+def test_cancelled_async_stream_ends_the_half_open_trial():
+    async def consume(model):
+        response = await model.generate_content_async("hi", stream=True)
+        async for _ in response:
+            await asyncio.sleep(10)
+
+    async def main():
+        model = guarded(FakeGenerativeModel(latency=0.0))
+        model.breaker = open_breaker()
+        task = asyncio.ensure_future(consume(model))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return model.breaker
+
+    breaker = asyncio.run(main())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.accepting()
+
+
+def test_completed_stream_closes_the_breaker():
+    model = guarded(FakeGenerativeModel(latency=0.0))
+    model.breaker = open_breaker()
+    text = "".join(chunk.text for chunk in model.generate_content("hi", stream=True))
+    assert text.startswith("Echo: hi")
+    assert model.breaker.state == CircuitBreaker.CLOSED
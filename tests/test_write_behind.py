@@ -0,0 +1,140 @@
+# gemini_multichat_bot/tests/test_write_behind.py
+
+import logging
+import os
+import threading
+import time
+
+from core.write_behind import WriteBehindQueue
+
+logger = logging.getLogger("test_write_behind")
+
+
+class FakeStore:
+    """write_rows() target that records rows and fails while `down` is set."""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self._next_id = 1
+
+    def write_rows(self, rows: list):
+        if self.down:
+            raise ConnectionError("database is down")
+        for user_id, record, _ in rows:
+            record["id"] = self._next_id
+            self._next_id += 1
+            self.rows.append((user_id, record["content"]))
+
+
+def records(*texts) -> list:
+    return [{"id": None, "role": "user", "content": text} for text in texts]
+
+
+def test_flush_writes_rows_in_order_and_fills_in_ids():
+    store = FakeStore()
+    queue = WriteBehindQueue(store.write_rows, logger, batch_size=2)
+    written = records("a", "b", "c")
+    queue.enqueue("u1", written)
+    assert queue.pending_for("u1") == written
+    queue.flush()
+    assert store.rows == [("u1", "a"), ("u1", "b"), ("u1", "c")]
+    assert [record["id"] for record in written] == [1, 2, 3]
+    assert queue.pending_for("u1") == []
+
+
+def test_failed_batch_is_spilled_and_replayed_first(tmp_path):
+    store = FakeStore()
+    spill_path = str(tmp_path / "history.spill")
+    queue = WriteBehindQueue(store.write_rows, logger, spill_path=spill_path)
+    store.down = True
+    queue.enqueue("u1", records("a", "b"))
+    queue.flush()
+    assert os.path.exists(spill_path)
+    assert queue.stats()["spilled"] == 2
+
+    store.down = False
+    queue.enqueue("u1", records("c"))
+    queue.flush()
+    assert store.rows == [("u1", "a"), ("u1", "b"), ("u1", "c")]
+    assert not os.path.exists(spill_path)
+    assert not os.path.exists(spill_path + ".replay")
+    assert queue.stats()["replayed"] == 2
+
+
+def test_spill_left_by_another_process_is_replayed_on_start(tmp_path):
+    spill_path = str(tmp_path / "history.spill")
+    failing = FakeStore()
+    failing.down = True
+    crashed = WriteBehindQueue(failing.write_rows, logger, spill_path=spill_path)
+    crashed.enqueue("u1", records("a"))
+    crashed.flush()
+
+    store = FakeStore()
+    queue = WriteBehindQueue(store.write_rows, logger, flush_interval=0.01, spill_path=spill_path)
+    queue.start()
+    deadline = time.monotonic() + 5
+    while not queue.stats()["replayed"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.shutdown()
+    assert store.rows == [("u1", "a")]
+    assert not os.path.exists(spill_path)
+
+
+def test_failed_replay_keeps_the_unwritten_rows(tmp_path):
+    store = FakeStore()
+    spill_path = str(tmp_path / "history.spill")
+    queue = WriteBehindQueue(store.write_rows, logger, batch_size=1, spill_path=spill_path)
+    store.down = True
+    queue.enqueue("u1", records("a", "b"))
+    queue.flush() # "a" is spilled
+    queue.flush() # Replaying "a" fails, so "b" is spilled behind it
+    store.down = False
+    queue.enqueue("u1", records("c"))
+    queue.flush()
+    assert store.rows == [("u1", "a"), ("u1", "b"), ("u1", "c")]
+
+
+def test_shutdown_spills_what_the_database_did_not_take(tmp_path):
+    store = FakeStore()
+    store.down = True
+    spill_path = str(tmp_path / "history.spill")
+    queue = WriteBehindQueue(store.write_rows, logger, spill_path=spill_path)
+    queue.start()
+    queue.enqueue("u1", records("a", "b"))
+    queue.shutdown(timeout=1.0)
+    with open(spill_path, encoding="utf-8") as spill_file:
+        assert len(spill_file.readlines()) == 2
+
+
+def test_shutdown_does_not_flush_beside_a_stuck_flusher(tmp_path):
+    entered, release = threading.Event(), threading.Event()
+    calls = []
+
+    def stuck_write(rows):
+        calls.append(len(rows))
+        entered.set()
+        release.wait(5)
+        for _, record, _ in rows:
+            record["id"] = 1
+
+    spill_path = str(tmp_path / "history.spill")
+    queue = WriteBehindQueue(stuck_write, logger, batch_size=1, flush_interval=0.01, spill_path=spill_path)
+    queue.start()
+    queue.enqueue("u1", records("a"))
+    assert entered.wait(5)
+    queue.enqueue("u1", records("b"))
+    queue.shutdown(timeout=0.1)
+    release.set()
+    assert calls == [1] # Only the flusher's own batch was written
+    with open(spill_path, encoding="utf-8") as spill_file:
+        assert '"content": "b"' in spill_file.read()
+
+
+def test_rows_are_dropped_without_a_spill_file():
+    store = FakeStore()
+    store.down = True
+    queue = WriteBehindQueue(store.write_rows, logger)
+    queue.enqueue("u1", records("a"))
+    queue.flush()
+    assert queue.stats()["dropped"] == 1
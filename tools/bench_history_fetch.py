@@ -0,0 +1,141 @@
+# gemini_multichat_bot/tools/bench_history_fetch.py
+"""
+Benchmarks the fetch_history_from_db query with and without the
+(user_id, timestamp DESC, id DESC) index added by schema migration 2.
+
+It works on a scratch table (chat_history_bench by default) so it never touches
+real chat history. Point it at a throwaway database:
+
+    python -m tools.bench_history_fetch --dsn postgresql://localhost/bench \
+        --rows 1000000 10000000 50000000
+
+Loading 50M rows takes a while and needs several GB of disk.
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+HISTORY_LIMIT = 20 # Same as core.main.MAX_HISTORY_MESSAGES
+LOAD_CHUNK_ROWS = 1_000_000
+
+
+def load_rows(conn, table: str, target_rows: int, users: int):
+    """Tops the scratch table up to target_rows rows spread over `users` user ids."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(table)))
+        current = cur.fetchone()[0]
+        while current < target_rows:
+            chunk = min(LOAD_CHUNK_ROWS, target_rows - current)
+            cur.execute(
+                sql.SQL("""
+                    INSERT INTO {} (user_id, role, content, timestamp)
+                    SELECT 'bench:' || (g %% %s),
+                           CASE WHEN g %% 2 = 0 THEN 'user' ELSE 'model' END,
+                           repeat('x', 80),
+                           TIMESTAMP '2024-01-01' + (g * INTERVAL '1 second')
+                    FROM generate_series(%s, %s) AS g
+                """).format(sql.Identifier(table)),
+                (users, current + 1, current + chunk)
+            )
+            conn.commit()
+            current += chunk
+            print(f"  loaded {current:,} / {target_rows:,} rows")
+        cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+        conn.commit()
+
+
+def time_fetches(conn, table: str, users: int, queries: int) -> dict:
+    latencies = []
+    query = sql.SQL("""
+        SELECT role, content FROM {}
+        WHERE user_id = %s
+        ORDER BY timestamp DESC, id DESC
+        LIMIT %s
+    """).format(sql.Identifier(table))
+    with conn.cursor() as cur:
+        for _ in range(queries):
+            user_id = f"bench:{random.randrange(users)}"
+            start = time.perf_counter()
+            cur.execute(query, (user_id, HISTORY_LIMIT))
+            cur.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    conn.rollback()
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "max_ms": latencies[-1],
+    }
+
+
+def set_index(conn, table: str, present: bool):
+    index = sql.Identifier(f"{table}_user_recent")
+    with conn.cursor() as cur:
+        if present:
+            cur.execute(
+                sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (user_id, timestamp DESC, id DESC)").format(
+                    index, sql.Identifier(table)
+                )
+            )
+        else:
+            cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(index))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Connection string of a throwaway database.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument("--users", type=int, default=100_000, help="Distinct user ids to spread rows over.")
+    parser.add_argument("--queries", type=int, default=200, help="Fetches timed per configuration.")
+    parser.add_argument("--table", default="chat_history_bench")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch table afterwards.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    table = sql.Identifier(args.table)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} (
+                id SERIAL PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """).format(table))
+    conn.commit()
+
+    results = []
+    try:
+        for rows in sorted(args.rows):
+            print(f"Preparing {rows:,} rows...")
+            load_rows(conn, args.table, rows, args.users)
+            set_index(conn, args.table, present=False)
+            before = time_fetches(conn, args.table, args.users, args.queries)
+            set_index(conn, args.table, present=True)
+            after = time_fetches(conn, args.table, args.users, args.queries)
+            results.append((rows, before, after))
+    finally:
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+            conn.commit()
+        conn.close()
+
+    print()
+    print(f"{'rows':>12} | {'no index p50':>12} {'p95':>10} | {'index p50':>10} {'p95':>10}")
+    for rows, before, after in results:
+        print(
+            f"{rows:>12,} | {before['p50_ms']:>10.2f}ms {before['p95_ms']:>8.2f}ms"
+            f" | {after['p50_ms']:>8.2f}ms {after['p95_ms']:>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
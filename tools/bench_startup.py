@@ -0,0 +1,102 @@
+# gemini_multichat_bot/tools/bench_startup.py
+"""
+Measures startup cost of the bot core, in fresh interpreters so nothing is cached:
+
+- import time of core.main, from `python -X importtime` (cumulative, microseconds)
+- time from interpreter start to the first generated reply, using the local fake
+  model (GEMINI_FAKE_MODEL=true, zero latency) so only our own startup is measured
+
+    python -m tools.bench_startup --runs 5 --import-budget-ms 300 --first-reply-budget-ms 800
+
+Exits with status 1 if a median exceeds its budget, so it can gate CI and the numbers
+can be tracked over time. DATABASE_URL is blanked in the child environment unless
+--with-db is given, in which case init() also opens the pool.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+FIRST_REPLY_SCRIPT = """
+import time
+from core import main as core_logic
+core_logic.init()
+reply = core_logic.generate_chat_response("bench:startup", "hello", core_logic.logger)
+print(f"FIRST_REPLY {time.time():.6f}")
+"""
+
+
+def child_env(with_db: bool) -> dict:
+    env = dict(os.environ)
+    env["GEMINI_FAKE_MODEL"] = "true"
+    env["FAKE_MODEL_LATENCY"] = "0"
+    env["FAKE_MODEL_TOKENS_PER_SECOND"] = "0"
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    if not with_db:
+        env["DATABASE_URL"] = "" # Empty rather than unset: also hides a DATABASE_URL from .env (load_dotenv does not override)
+    return env
+
+
+def measure_import_ms(env: dict) -> float:
+    """Cumulative import time of core.main in milliseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import core.main"],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if len(fields) == 3 and fields[2] == "core.main":
+            return int(fields[1]) / 1000.0
+    raise RuntimeError("core.main not found in -X importtime output")
+
+
+def measure_first_reply_ms(env: dict) -> float:
+    started = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_REPLY_SCRIPT],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("FIRST_REPLY "):
+            return (float(line.split()[1]) - started) * 1000.0
+    raise RuntimeError("First reply marker not found in child output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=None)
+    parser.add_argument("--first-reply-budget-ms", type=float, default=None)
+    parser.add_argument("--with-db", action="store_true", help="Keep DATABASE_URL so the pool is opened too.")
+    args = parser.parse_args()
+
+    env = child_env(args.with_db)
+    import_times = [measure_import_ms(env) for _ in range(args.runs)]
+    first_reply_times = [measure_first_reply_ms(env) for _ in range(args.runs)]
+
+    results = [
+        ("import core.main", import_times, args.import_budget_ms),
+        ("start to first reply", first_reply_times, args.first_reply_budget_ms),
+    ]
+    over_budget = False
+    print(f"{'measurement':>22} | {'median ms':>10} | {'min ms':>10} | {'max ms':>10} | budget")
+    for name, samples, budget in results:
+        median = statistics.median(samples)
+        status = "-"
+        if budget is not None:
+            status = f"{budget:.0f} ms {'OK' if median <= budget else 'EXCEEDED'}"
+            over_budget = over_budget or median > budget
+        print(f"{name:>22} | {median:10.1f} | {min(samples):10.1f} | {max(samples):10.1f} | {status}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
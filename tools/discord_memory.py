@@ -0,0 +1,134 @@
+# gemini_multichat_bot/tools/discord_memory.py
+"""
+Measures the Discord client's cache memory per guild, offline: synthetic GUILD_CREATE
+and MESSAGE_CREATE payloads are fed into discord.py's ConnectionState under two
+configurations and the retained memory is measured with tracemalloc.
+
+  previous  default intents + members, member cache from intents, chunking at startup,
+            max_messages=1000 (the old discord_bot.py settings)
+  current   discord_bot.bot_options(): no members intent, MemberCacheFlags.none(),
+            no chunking, max_messages=DISCORD_MAX_MESSAGES
+
+    python -m tools.discord_memory --guilds 200 --members 500 --messages-per-guild 50
+
+Only the client caches are measured (guilds, channels, roles, members, messages); the
+shared Python and library baseline is excluded.
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+BOT_USER_ID = 10**17
+
+
+def _user(user_id: int) -> dict:
+    return {"id": str(user_id), "username": f"user{user_id}", "discriminator": "0", "avatar": None, "global_name": None}
+
+
+def guild_payload(guild_index: int, members: int, channels: int) -> dict:
+    guild_id = 10**15 + guild_index * 10**6
+    member_ids = [BOT_USER_ID] + [guild_id + 1000 + m for m in range(members - 1)]
+    return {
+        "id": str(guild_id),
+        "name": f"Guild {guild_index}",
+        "owner_id": str(member_ids[-1]),
+        "member_count": members,
+        "features": [],
+        "emojis": [],
+        "stickers": [],
+        "roles": [{
+            "id": str(guild_id), "name": "@everyone", "permissions": "1024", "position": 0,
+            "color": 0, "hoist": False, "managed": False, "mentionable": False,
+        }],
+        "channels": [
+            {"id": str(guild_id + 1 + c), "name": f"channel-{c}", "type": 0, "position": c,
+             "permission_overwrites": [], "nsfw": False, "parent_id": None}
+            for c in range(channels)
+        ],
+        "members": [
+            {"user": _user(member_id), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00",
+             "deaf": False, "mute": False, "flags": 0, "pending": False}
+            for member_id in member_ids
+        ],
+        "threads": [],
+        "voice_states": [],
+    }
+
+
+def message_payload(message_id: int, channel_id: int, author_id: int) -> dict:
+    return {
+        "id": str(message_id), "channel_id": str(channel_id), "author": _user(author_id),
+        "content": f"Message {message_id}: what do you think about the weather today?",
+        "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+        "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+        "embeds": [], "pinned": False, "type": 0, "flags": 0,
+    }
+
+
+def previous_options() -> dict:
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.members = True
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": True,
+        "max_messages": 1000,
+    }
+
+
+def measure(options: dict, args) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    state = ConnectionState(dispatch=lambda *a, **k: None, handlers={}, hooks={}, http=None, **options)
+    for guild_index in range(args.guilds):
+        guild = state._add_guild_from_data(guild_payload(guild_index, args.members, args.channels))
+        channel = guild.text_channels[0]
+        for m in range(args.messages_per_guild):
+            message = discord.Message(
+                state=state, channel=channel,
+                data=message_payload(channel.id * 1000 + m, channel.id, guild.id + 1000 + m % max(1, args.members - 1)),
+            )
+            if state._messages is not None: # What parse_message_create does
+                state._messages.append(message)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "bytes": retained,
+        "members_cached": sum(len(guild.members) for guild in state.guilds),
+        "messages_cached": len(state._messages) if state._messages is not None else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--members", type=int, default=500, help="Members per guild (including the bot).")
+    parser.add_argument("--channels", type=int, default=10, help="Text channels per guild.")
+    parser.add_argument("--messages-per-guild", type=int, default=50, help="Messages received per guild.")
+    args = parser.parse_args()
+
+    from platforms import discord_bot
+
+    print(f"{args.guilds} guilds x {args.members} members, {args.channels} channels, "
+          f"{args.messages_per_guild} messages each")
+    print(f"{'config':>10} | {'total MiB':>10} | {'KiB/guild':>10} | {'members cached':>14} | {'messages cached':>15}")
+    results = {}
+    for name, options in (("previous", previous_options()), ("current", discord_bot.bot_options())):
+        result = measure(options, args)
+        results[name] = result["bytes"]
+        print(f"{name:>10} | {result['bytes'] / 1048576:10.2f} | {result['bytes'] / 1024 / args.guilds:10.1f} | "
+              f"{result['members_cached']:>14} | {result['messages_cached']:>15}")
+    if results["previous"]:
+        print(f"Saved {100 * (1 - results['current'] / results['previous']):.0f}% of the client cache memory.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+# gemini_multichat_bot/tools/load_test.py
+"""
+Offline load test: drives synthetic multi-user chat traffic through the bot with the
+local fake Gemini model (core/fake_model.py), so no real Gemini, Twilio, Telegram or
+Discord services are involved.
+
+Targets:
+  core      generate_chat_response() called from a thread pool
+  whatsapp  POSTs to the whatsapp_webhook Flask route via app.test_client() (inline TwiML)
+  telegram  telegram_bot.handle_message() with fake Update/Message objects
+  discord   discord_bot.on_message() with fake Message/Channel objects
+
+History goes to a throwaway PostgreSQL database given with --dsn (migrated on start, load
+test rows deleted at the end unless --keep), to a temporary SQLite file (--backend sqlite),
+to in-process ring buffers (--backend memory) or nowhere (--backend none).
+
+    python -m tools.load_test --target whatsapp --users 50 --messages 10 \
+        --dsn postgresql://localhost/loadtest --model-latency 0.3 --tokens-per-second 80
+
+Reports messages/sec, p50/p95/p99 latency (and time to the first visible reply for the
+streaming platforms) and DB statements per turn from the connection pool's counter.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+USER_PREFIX = "loadtest:"
+RUN_TAG = f"{int(time.time()):x}" # Keeps MessageSids unique across runs (see processed_messages)
+TARGETS = ("core", "whatsapp", "telegram", "discord")
+
+
+def configure_environment(args):
+    """Must run before core.main is imported: all of its settings are read at import."""
+    os.environ["GEMINI_FAKE_MODEL"] = "true"
+    os.environ["FAKE_MODEL_LATENCY"] = str(args.model_latency)
+    os.environ["FAKE_MODEL_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["FAKE_MODEL_REPLY_TOKENS"] = str(args.reply_tokens)
+    os.environ["FAKE_MODEL_ERROR_RATE"] = str(args.error_rate)
+    os.environ["GEMINI_RATE_LIMIT_RPM"] = "0" # The fake has no quota to protect
+    os.environ["STREAM_RESPONSES"] = "true" if args.stream else "false"
+    os.environ["WHATSAPP_ASYNC_REPLIES"] = "false" # Measure the reply inside the webhook request
+    os.environ["DATABASE_URL"] = args.dsn if args.backend == "postgres" else ""
+    os.environ["HISTORY_BACKEND"] = args.backend
+    if args.backend == "sqlite":
+        os.environ["SQLITE_HISTORY_PATH"] = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "history.sqlite3")
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def message_text(user: int, turn: int) -> str:
+    return f"Message {turn} from user {user}: tell me something interesting about the number {user * 31 + turn}."
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.first_reply_latencies = []
+        self.errors = 0
+
+    def add(self, latency: float, first_reply: float = None):
+        with self._lock:
+            self.latencies.append(latency)
+            if first_reply is not None:
+                self.first_reply_latencies.append(first_reply)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+
+# --- Thread-driven targets ---
+
+def run_threaded(send_one, args, recorder: Recorder):
+    def user_session(user: int):
+        for turn in range(args.messages):
+            started = time.perf_counter()
+            try:
+                send_one(f"{USER_PREFIX}{user}", message_text(user, turn), f"SMload{RUN_TAG}u{user}t{turn}")
+            except Exception as e:
+                print(f"  error for user {user}: {e}", file=sys.stderr)
+                recorder.error()
+                continue
+            recorder.add(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        list(executor.map(user_session, range(args.users)))
+
+
+def core_sender(core_logic):
+    def send_one(user_id: str, text: str, message_id: str):
+        core_logic.generate_chat_response(user_id, text, core_logic.logger, platform="loadtest")
+    return send_one
+
+
+def whatsapp_sender():
+    from platforms import whatsapp_bot
+    client = whatsapp_bot.app.test_client()
+
+    def send_one(user_id: str, text: str, message_id: str):
+        response = client.post("/whatsapp_webhook", data={"Body": text, "From": user_id, "MessageSid": message_id})
+        if response.status_code != 200:
+            raise RuntimeError(f"webhook returned HTTP {response.status_code}")
+    return send_one
+
+
+# --- Event-loop-driven targets (fake platform objects) ---
+
+class _FakeSentMessage:
+    async def edit_text(self, text):
+        return self
+
+    async def edit(self, content=None):
+        return self
+
+
+class _FakeTelegramMessage:
+    def __init__(self, text: str, on_reply):
+        self.text = text
+        self.date = datetime.datetime.now(datetime.timezone.utc)
+        self._on_reply = on_reply
+
+    async def reply_text(self, text, **kwargs):
+        self._on_reply()
+        return _FakeSentMessage()
+
+
+class _FakeTelegramUser:
+    def __init__(self, user_id: str):
+        self.id = user_id
+
+
+class _FakeUpdate:
+    def __init__(self, user_id: str, text: str, on_reply):
+        self.effective_user = _FakeTelegramUser(user_id)
+        self.message = _FakeTelegramMessage(text, on_reply)
+
+
+class _FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class _FakeChannel:
+    def __init__(self, on_reply):
+        self._on_reply = on_reply
+
+    async def send(self, content=None, **kwargs):
+        self._on_reply()
+        return _FakeSentMessage()
+
+    def typing(self):
+        return _FakeTyping()
+
+
+class _FakeDiscordAuthor:
+    def __init__(self, user_id: str):
+        self.id = user_id
+
+
+class _FakeDiscordMessage:
+    def __init__(self, user_id: str, text: str, on_reply):
+        self.author = _FakeDiscordAuthor(user_id)
+        self.content = text
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.channel = _FakeChannel(on_reply)
+
+
+async def run_async_target(handle, args, recorder: Recorder):
+    async def user_session(user: int):
+        for turn in range(args.messages):
+            started = time.perf_counter()
+            first_reply = []
+
+            def on_reply():
+                if not first_reply:
+                    first_reply.append(time.perf_counter() - started)
+
+            try:
+                await handle(f"{USER_PREFIX}{user}", message_text(user, turn), on_reply)
+            except Exception as e:
+                print(f"  error for user {user}: {e}", file=sys.stderr)
+                recorder.error()
+                continue
+            recorder.add(time.perf_counter() - started, first_reply[0] if first_reply else None)
+
+    await asyncio.gather(*(user_session(user) for user in range(args.users)))
+
+
+def telegram_handler():
+    from platforms import telegram_bot
+
+    async def handle(user_id: str, text: str, on_reply):
+        await telegram_bot.handle_message(_FakeUpdate(user_id, text, on_reply), None)
+    return handle
+
+
+def discord_handler():
+    from platforms import discord_bot
+
+    async def handle(user_id: str, text: str, on_reply):
+        await discord_bot.on_message(_FakeDiscordMessage(user_id, text, on_reply))
+    return handle
+
+
+def delete_load_test_rows(core_logic):
+    with core_logic.db_connection(core_logic.logger) as conn:
+        if not conn:
+            return
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM chat_history WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+            cur.execute("DELETE FROM chat_summaries WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+            cur.execute("DELETE FROM processed_messages WHERE user_id LIKE %s", (USER_PREFIX + "%",))
+        conn.commit()
+
+
+def print_report(target: str, recorder: Recorder, elapsed: float, queries: int, args):
+    turns = len(recorder.latencies)
+    print(f"\nTarget: {target} ({args.users} users x {args.messages} messages, backend {args.backend})")
+    print(f"  completed turns:  {turns} ({recorder.errors} errors) in {elapsed:.2f}s")
+    print(f"  throughput:       {turns / elapsed if elapsed else 0:.1f} messages/sec")
+    for label, samples in (("latency", recorder.latencies), ("first reply", recorder.first_reply_latencies)):
+        if samples:
+            print(
+                f"  {label + ':':<17} p50 {percentile(samples, 50) * 1000:.1f} ms | "
+                f"p95 {percentile(samples, 95) * 1000:.1f} ms | p99 {percentile(samples, 99) * 1000:.1f} ms | "
+                f"mean {statistics.mean(samples) * 1000:.1f} ms"
+            )
+    if args.backend == "postgres":
+        print(f"  DB statements:    {queries} total, {queries / turns if turns else 0:.2f} per turn")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=TARGETS + ("all",), default="core")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent simulated users.")
+    parser.add_argument("--messages", type=int, default=10, help="Messages sent by each user, one after another.")
+    parser.add_argument("--backend", choices=("postgres", "sqlite", "memory", "none"), default=None,
+                        help="History backend (default: postgres if --dsn is given, otherwise memory).")
+    parser.add_argument("--dsn", default=None, help="Throwaway PostgreSQL database for the postgres backend.")
+    parser.add_argument("--keep", action="store_true", help="Keep the load test rows in the database.")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Fake model time to first token (s).")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Fake model output speed (0 = instant).")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake retryable upstream error probability.")
+    parser.add_argument("--stream", action="store_true", help="Stream replies on Telegram/Discord.")
+    args = parser.parse_args()
+    if args.backend is None:
+        args.backend = "postgres" if args.dsn else "memory"
+    if args.backend == "postgres" and not args.dsn:
+        parser.error("--backend postgres needs --dsn")
+
+    configure_environment(args)
+    from core import main as core_logic
+    core_logic.init(core_logic.logger, migrate=args.backend == "postgres")
+
+    try:
+        asyncio.run(run_targets(core_logic, args))
+    finally:
+        if args.backend == "postgres" and not args.keep:
+            delete_load_test_rows(core_logic)
+        core_logic.shutdown_write_behind()
+        core_logic.close_history_store()
+        core_logic.close_response_cache()
+        core_logic.close_db_pool()
+
+
+async def run_targets(core_logic, args):
+    # Like core.run: one loop hosts the dispatcher, and the threaded targets (the Flask
+    # webhook) submit to it from worker threads.
+    loop = asyncio.get_running_loop()
+    core_logic.dispatcher.bind_loop(loop)
+
+    targets = TARGETS if args.target == "all" else (args.target,)
+    for target in targets:
+        recorder = Recorder()
+        queries_before = core_logic.get_db_pool_stats().get("queries", 0)
+        started = time.perf_counter()
+        if target == "core":
+            await loop.run_in_executor(None, run_threaded, core_sender(core_logic), args, recorder)
+        elif target == "whatsapp":
+            await loop.run_in_executor(None, run_threaded, whatsapp_sender(), args, recorder)
+        else:
+            handle = telegram_handler() if target == "telegram" else discord_handler()
+            await run_async_target(handle, args, recorder)
+        elapsed = time.perf_counter() - started
+        if core_logic.write_behind:
+            # Count this run's deferred history writes too
+            await loop.run_in_executor(None, core_logic.write_behind.flush)
+        queries = core_logic.get_db_pool_stats().get("queries", 0) - queries_before
+        print_report(target, recorder, elapsed, queries, args)
+    print(f"\nDispatcher: {core_logic.get_dispatcher_stats()}")
+    print(f"Gemini resilience: {core_logic.get_model_resilience_stats()}")
+    if args.backend == "memory":
+        print(f"History store: {core_logic.get_history_store_stats()}")
+    if core_logic.response_cache:
+        print(f"Response cache: {core_logic.get_response_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
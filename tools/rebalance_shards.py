@@ -0,0 +1,248 @@
+# gemini_multichat_bot/tools/rebalance_shards.py
+"""
+Moves chat history between the HISTORY_SHARDS databases after the shard ring changed,
+while the bots keep running.
+
+1. Add the new shard to HISTORY_SHARDS and HISTORY_SHARD_RING, set
+   HISTORY_SHARD_PREVIOUS_RING to the old ring and run python -m core.migrate.
+2. Deploy. Users whose shard changed keep using their old shard until they are moved.
+3. Run this tool. For every such user it copies the history rows and summary to the
+   new shard and records the move in chat_history_moves there, in one transaction;
+   from then on the bots read and write the user on the new shard. After
+   --settle-seconds it copies any rows that were still written to the old shard, then
+   deletes the copied rows at the source.
+4. Remove HISTORY_SHARD_PREVIOUS_RING, deploy, and run this tool with --finish to
+   clear the move markers.
+
+    python -m tools.rebalance_shards --dry-run
+    python -m tools.rebalance_shards --batch-users 200 --settle-seconds 10
+    python -m tools.rebalance_shards --finish
+
+It can be stopped and rerun at any time: users are copied from where the marker says
+the last copy ended, and rows are deleted at the source only after their copy committed.
+
+Limitation: source writes are not blocked while a user moves. A turn that looked the
+user up just before the marker committed still writes to the old shard, and the settle
+sweep copies that row after the bots may already have written newer rows on the new
+shard, so its new id is higher than theirs. Rows keep their original timestamps and
+history is read ORDER BY timestamp DESC, id DESC, so the conversation stays in order;
+only rows with identical timestamps, and the id-based rolling summary boundary
+(summarized_through_id), can see such a row out of place until it ages out.
+"""
+
+import argparse
+import bisect
+import logging
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from core import main as core_logic
+from core.sharding import HashRing
+
+logger = logging.getLogger("rebalance_shards")
+
+
+def misplaced_users(source: str, ring: HashRing) -> dict:
+    """{user_id: rows} for users with history on `source` who belong on another shard."""
+    with core_logic.shard_connection(source, logger) as conn:
+        if not conn:
+            raise RuntimeError(f"No connection to shard {source}.")
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT user_id, SUM(rows) FROM (
+                    SELECT user_id, COUNT(*) AS rows FROM chat_history GROUP BY user_id
+                    UNION ALL
+                    SELECT user_id, 0 AS rows FROM chat_summaries
+                ) AS users
+                GROUP BY user_id
+                """
+            )
+            users = cur.fetchall()
+        conn.rollback()
+    return {user_id: int(rows) for user_id, rows in users if ring.node_for(user_id) != source}
+
+
+def _remap(through_id: int, mapping: list) -> int:
+    """New id of the last copied row at or before through_id (0 if none), mapping sorted by old id."""
+    index = bisect.bisect_right(mapping, (through_id, float("inf")))
+    return mapping[index - 1][1] if index else 0
+
+
+def copy_user(source: str, destination: str, user_id: str) -> int:
+    """
+    Copies the user's rows not copied yet (and, the first time, the summary) from source
+    to destination and records the move there. Returns the highest source id copied.
+    """
+    with core_logic.shard_connection(destination, logger) as dest:
+        if not dest:
+            raise RuntimeError(f"No connection to shard {destination}.")
+        with dest.cursor() as cur:
+            cur.execute("SELECT copied_through_id FROM chat_history_moves WHERE user_id = %s", (user_id,))
+            marker = cur.fetchone()
+        dest.rollback()
+        copied_through_id = marker[0] if marker else 0
+
+        with core_logic.shard_connection(source, logger) as src:
+            if not src:
+                raise RuntimeError(f"No connection to shard {source}.")
+            with src.cursor() as cur:
+                cur.execute(
+                    "SELECT id, role, content, timestamp FROM chat_history WHERE user_id = %s AND id > %s ORDER BY id",
+                    (user_id, copied_through_id)
+                )
+                rows = cur.fetchall()
+                summary = None
+                if marker is None:
+                    cur.execute(
+                        "SELECT summary, summarized_through_id, updated_at FROM chat_summaries WHERE user_id = %s",
+                        (user_id,)
+                    )
+                    summary = cur.fetchone()
+            src.rollback()
+
+        try:
+            with dest.cursor() as cur:
+                mapping = []
+                if rows:
+                    inserted = execute_values(
+                        cur,
+                        "INSERT INTO chat_history (user_id, role, content, timestamp) VALUES %s RETURNING id",
+                        [(user_id, role, content, timestamp) for _, role, content, timestamp in rows],
+                        page_size=len(rows),
+                        fetch=True,
+                    )
+                    mapping = [(row[0], new[0]) for row, new in zip(rows, inserted)]
+                    copied_through_id = rows[-1][0]
+                if summary is not None:
+                    # Ids are per database; the summary covers the copies of the rows it covered
+                    cur.execute(
+                        """
+                        INSERT INTO chat_summaries (user_id, summary, summarized_through_id, updated_at)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (user_id) DO NOTHING
+                        """,
+                        (user_id, summary[0], _remap(summary[1], mapping), summary[2])
+                    )
+                cur.execute(
+                    """
+                    INSERT INTO chat_history_moves (user_id, source_shard, copied_through_id)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (user_id) DO UPDATE SET copied_through_id = EXCLUDED.copied_through_id
+                    """,
+                    (user_id, source, copied_through_id)
+                )
+            dest.commit()
+        except psycopg2.Error:
+            dest.rollback()
+            raise
+    return copied_through_id
+
+
+def delete_source_rows(source: str, user_id: str, copied_through_id: int):
+    with core_logic.shard_connection(source, logger) as conn:
+        if not conn:
+            raise RuntimeError(f"No connection to shard {source}.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM chat_history WHERE user_id = %s AND id <= %s", (user_id, copied_through_id))
+                cur.execute("DELETE FROM chat_summaries WHERE user_id = %s", (user_id,))
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+
+
+def move_batch(source: str, users: list, ring: HashRing, settle_seconds: float) -> int:
+    """Copies, settles, sweeps and deletes a batch of users; returns the rows moved."""
+    for user_id in users:
+        copy_user(source, ring.node_for(user_id), user_id)
+    # Bots that picked the old shard just before the marker committed may still write
+    # there; wait for those turns to finish, then copy what they wrote. Those copies keep
+    # their timestamps, which is what reads order by (see the module docstring).
+    time.sleep(settle_seconds)
+    moved = 0
+    for user_id in users:
+        copied_through_id = copy_user(source, ring.node_for(user_id), user_id)
+        delete_source_rows(source, user_id, copied_through_id)
+        moved += 1
+    return moved
+
+
+def finish(ring: HashRing) -> int:
+    leftovers = {name: len(misplaced_users(name, ring)) for name in core_logic.HISTORY_SHARDS}
+    if any(leftovers.values()):
+        print(f"Users still on the wrong shard: {leftovers}. Run the rebalance again first.")
+        return 1
+    for name in core_logic.HISTORY_SHARDS:
+        with core_logic.shard_connection(name, logger) as conn:
+            if not conn:
+                return 1
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM chat_history_moves")
+                cleared = cur.rowcount
+            conn.commit()
+        print(f"{name}: cleared {cleared} move markers.")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Only report which users would move where.")
+    parser.add_argument("--batch-users", type=int, default=100, help="Users copied before each settle pause.")
+    parser.add_argument("--settle-seconds", type=float, default=5.0,
+                        help="Wait between marking users moved and deleting their rows at the source.")
+    parser.add_argument("--finish", action="store_true",
+                        help="Clear the move markers once HISTORY_SHARD_PREVIOUS_RING has been removed everywhere.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not core_logic.HISTORY_SHARDS:
+        logger.error("HISTORY_SHARDS is not set; nothing to rebalance.")
+        return 1
+    ring = HashRing(core_logic.HISTORY_SHARD_RING)
+
+    try:
+        if args.finish:
+            if core_logic.HISTORY_SHARD_PREVIOUS_RING:
+                logger.error("Remove HISTORY_SHARD_PREVIOUS_RING (and deploy) before --finish.")
+                return 1
+            return finish(ring)
+
+        if not core_logic.HISTORY_SHARD_PREVIOUS_RING and not args.dry_run:
+            logger.warning(
+                "HISTORY_SHARD_PREVIOUS_RING is not set: running bots already look for moved users on "
+                "their new shard and miss their history until it is copied."
+            )
+        total = 0
+        for source in core_logic.HISTORY_SHARDS:
+            users = misplaced_users(source, ring)
+            if args.dry_run:
+                targets = {}
+                for user_id, rows in users.items():
+                    destination = ring.node_for(user_id)
+                    count, row_total = targets.get(destination, (0, 0))
+                    targets[destination] = (count + 1, row_total + rows)
+                for destination, (count, rows) in targets.items():
+                    print(f"{source} -> {destination}: {count} users, {rows} rows")
+                continue
+            user_ids = sorted(users)
+            for start in range(0, len(user_ids), args.batch_users):
+                total += move_batch(source, user_ids[start:start + args.batch_users], ring, args.settle_seconds)
+                print(f"{source}: moved {min(start + args.batch_users, len(user_ids))}/{len(user_ids)} users")
+        if not args.dry_run:
+            print(f"Moved {total} users.")
+    except (psycopg2.Error, RuntimeError) as e:
+        logger.error(f"Rebalance stopped: {e}. It is safe to run it again.")
+        return 1
+    finally:
+        core_logic.close_db_pool()
+        core_logic.close_shard_pools()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
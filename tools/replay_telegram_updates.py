@@ -0,0 +1,282 @@
+# gemini_multichat_bot/tools/replay_telegram_updates.py
+"""
+Posts recorded Telegram Update payloads to a bot running in webhook mode, the way
+Telegram would. With --offline the bot runs inside this process, with the fake Gemini
+model, in-memory history and a fake Bot API (no token or network needed):
+
+    python -m tools.replay_telegram_updates --offline
+
+It starts the real webhook server on a free local port, checks that a wrong secret
+token is rejected, posts every update twice and fails unless each update is
+acknowledged with 200 and every new message gets exactly one reply (edited messages
+none). Otherwise it posts to a bot started separately, e.g. before pointing Telegram at it:
+
+    TELEGRAM_MODE=webhook TELEGRAM_WEBHOOK_URL=https://example.invalid \\
+        TELEGRAM_WEBHOOK_SECRET=local-secret GEMINI_FAKE_MODEL=true \\
+        python -m platforms.telegram_bot &
+    python -m tools.replay_telegram_updates --secret local-secret --redeliver --check-secret
+
+Every update must be accepted with HTTP 200; with --check-secret a request carrying a
+wrong secret token must be rejected (403). --redeliver posts each update twice, like a
+Telegram retry, which the bot must answer only once (see its log). --repeat replays the
+fixtures several times with fresh update_ids. Exits with status 1 on any unexpected
+response. The chats in the fixtures do not exist, so the bot's replies fail to send.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "telegram_updates.json")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def default_url() -> str:
+    port = os.getenv("TELEGRAM_WEBHOOK_PORT", os.getenv("PORT", "8443"))
+    path = os.getenv("TELEGRAM_WEBHOOK_PATH", "telegram_webhook").strip("/")
+    return f"http://127.0.0.1:{port}/{path}"
+
+
+def load_updates(path: str, repeat: int) -> list:
+    with open(path, encoding="utf-8") as f:
+        recorded = json.load(f)
+    span = max(update["update_id"] for update in recorded) - min(update["update_id"] for update in recorded) + 1
+    now = int(time.time())
+    updates = []
+    for round_index in range(repeat):
+        for update in recorded:
+            update = copy.deepcopy(update)
+            update["update_id"] += round_index * span
+            # Recorded dates are long past; the bot would shed them as expired (REPLY_DEADLINE_SECONDS)
+            for message in (update.get("message"), update.get("edited_message")):
+                if message:
+                    message["date"] = now
+            updates.append(update)
+    return updates
+
+
+def post_update(url: str, secret: str, update: dict, timeout: float):
+    """Returns (HTTP status, seconds); status 0 if the request failed outright."""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode("utf-8"),
+        headers={"Content-Type": "application/json", SECRET_HEADER: secret or ""},
+        method="POST",
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError) as e:
+        print(f"  update {update['update_id']}: {e}", file=sys.stderr)
+        status = 0
+    return status, time.perf_counter() - started
+
+
+def post_all(url: str, secret: str, updates: list, concurrency: int, timeout: float) -> tuple:
+    """Posts updates concurrently; returns ([(status, seconds)], elapsed seconds)."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(lambda update: post_update(url, secret, update, timeout), updates))
+        return results, time.perf_counter() - started
+
+
+def report(url: str, updates: list, results: list, elapsed: float) -> int:
+    """Prints status counts and latencies; returns the number of non-200 responses."""
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+    print(f"Posted {len(updates)} updates to {url} in {elapsed:.2f}s: "
+          + ", ".join(f"HTTP {status} x{count}" for status, count in sorted(statuses.items())))
+    if latencies:
+        p95 = latencies[max(0, int(round(0.95 * len(latencies))) - 1)]
+        print(f"Acknowledgement latency: median {statistics.median(latencies) * 1000:.1f} ms | "
+              f"p95 {p95 * 1000:.1f} ms | max {latencies[-1] * 1000:.1f} ms")
+    return sum(count for status, count in statuses.items() if status != 200)
+
+
+def check_secret(url: str, secret: str, update: dict, timeout: float) -> int:
+    status, _ = post_update(url, secret + "-wrong", update, timeout)
+    ok = status == 403
+    print(f"Wrong secret token: HTTP {status} ({'rejected as expected' if ok else 'expected 403'})")
+    return 0 if ok else 1
+
+
+# --- Offline mode: the bot in this process, behind a fake Bot API ---
+
+def configure_offline_environment(secret: str, port: int):
+    """Must run before platforms.telegram_bot / core.main are imported: they read settings at import."""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:offline-replay",
+        "TELEGRAM_MODE": "webhook",
+        "TELEGRAM_WEBHOOK_URL": "https://replay.invalid",
+        "TELEGRAM_WEBHOOK_SECRET": secret,
+        "TELEGRAM_WEBHOOK_LISTEN": "127.0.0.1",
+        "TELEGRAM_WEBHOOK_PORT": str(port),
+        "GEMINI_FAKE_MODEL": "true",
+        "FAKE_MODEL_LATENCY": "0.05",
+        "GEMINI_RATE_LIMIT_RPM": "0",
+        "STREAM_RESPONSES": "false",
+        "DATABASE_URL": "",
+        "HISTORY_SHARDS": "",
+        "HISTORY_BACKEND": "memory",
+        "RESPONSE_CACHE": "off",
+        "MESSAGE_DEDUP_ENABLED": "true",
+    })
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _fake_bot_api_request():
+    from telegram.request import BaseRequest
+
+    class FakeBotAPI(BaseRequest):
+        """Answers Bot API calls locally and records the messages the bot sends."""
+
+        def __init__(self):
+            self.sent = [] # (chat_id, text)
+            self._message_ids = 0
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def _message(self, chat_id, text: str) -> dict:
+            self._message_ids += 1
+            return {"message_id": self._message_ids, "date": int(time.time()), "text": text,
+                    "chat": {"id": int(chat_id), "type": "private"}}
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                             connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit("/", 1)[-1]
+            params = request_data.parameters if request_data is not None else {}
+            if api_method == "getMe":
+                result = {"id": 123456, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+            elif api_method == "sendMessage":
+                self.sent.append((int(params["chat_id"]), params["text"]))
+                result = self._message(params["chat_id"], params["text"])
+            elif api_method == "editMessageText":
+                result = self._message(params["chat_id"], params["text"])
+            else: # setWebhook, deleteWebhook, sendChatAction, ...
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    return FakeBotAPI()
+
+
+def expected_replies(updates: list) -> dict:
+    """{chat_id: replies}: one per distinct new message, none for edits or redeliveries."""
+    expected = {}
+    for update in {update["update_id"]: update for update in updates}.values():
+        if "message" in update:
+            chat_id = update["message"]["chat"]["id"]
+            expected[chat_id] = expected.get(chat_id, 0) + 1
+    return expected
+
+
+async def run_offline(args, updates: list) -> int:
+    port = free_port()
+    configure_offline_environment(args.secret, port)
+    from core import main as core_logic
+    from platforms import telegram_bot
+
+    loop = asyncio.get_running_loop()
+    core_logic.dispatcher.bind_loop(loop)
+    api = _fake_bot_api_request()
+    application = telegram_bot.build_application(request=api)
+    telegram_bot.prepare_webhook_instance()
+    await application.initialize()
+    await application.start()
+    await application.updater.start_webhook(**telegram_bot.webhook_options())
+    url = f"http://127.0.0.1:{port}/{telegram_bot.TELEGRAM_WEBHOOK_PATH}"
+
+    failures = 0
+    try:
+        failures += await loop.run_in_executor(None, check_secret, url, args.secret, updates[0], args.timeout)
+        redelivered = [update for update in updates for _ in range(2)]
+        results, elapsed = await loop.run_in_executor(
+            None, post_all, url, args.secret, redelivered, args.concurrency, args.timeout
+        )
+        failures += report(url, redelivered, results, elapsed)
+
+        expected = expected_replies(updates)
+        deadline = time.monotonic() + args.timeout
+        while len(api.sent) < sum(expected.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await core_logic.dispatcher.wait_idle(args.timeout)
+        await asyncio.sleep(0.5) # Give a wrongly answered redelivery time to show up
+        replies = {}
+        for chat_id, _ in api.sent:
+            replies[chat_id] = replies.get(chat_id, 0) + 1
+        for chat_id in sorted(set(expected) | set(replies)):
+            ok = replies.get(chat_id, 0) == expected.get(chat_id, 0)
+            failures += not ok
+            print(f"Chat {chat_id}: {replies.get(chat_id, 0)} replies, expected {expected.get(chat_id, 0)}"
+                  + ("" if ok else "  <-- MISMATCH"))
+        print(f"Dedup: {core_logic.message_dedup.stats() if core_logic.message_dedup else 'disabled'}")
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        core_logic.shutdown_write_behind()
+        core_logic.close_history_store()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=default_url(), help="Webhook URL (default: local TELEGRAM_WEBHOOK_PORT/PATH).")
+    parser.add_argument("--secret", default=os.getenv("TELEGRAM_WEBHOOK_SECRET"),
+                        help="Secret token (default: $TELEGRAM_WEBHOOK_SECRET).")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="JSON list of recorded Update payloads.")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the fixtures this many times.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once.")
+    parser.add_argument("--redeliver", action="store_true", help="Post every update twice.")
+    parser.add_argument("--check-secret", action="store_true", help="Also expect a wrong secret to be rejected.")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--offline", action="store_true",
+                        help="Run the bot in this process against a fake Bot API (implies --redeliver --check-secret).")
+    args = parser.parse_args()
+    updates = load_updates(args.fixtures, args.repeat)
+
+    if args.offline:
+        args.secret = args.secret or "offline-replay-secret"
+        sys.exit(1 if asyncio.run(run_offline(args, updates)) else 0)
+
+    if not args.secret:
+        parser.error("No secret token; pass --secret or set TELEGRAM_WEBHOOK_SECRET.")
+    if args.redeliver:
+        updates = [update for update in updates for _ in range(2)]
+
+    failures = 0
+    if args.check_secret:
+        failures += check_secret(args.url, args.secret, updates[0], args.timeout)
+    results, elapsed = post_all(args.url, args.secret, updates, args.concurrency, args.timeout)
+    failures += report(args.url, updates, results, elapsed)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()